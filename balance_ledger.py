@@ -0,0 +1,73 @@
+import threading
+import time
+
+from helpers import PeriodicTask
+
+
+class BalanceLedger:
+    """Local copy of the USD balance in cents. Buys reserve and spend from it without an api call,
+    a background thread reconciles it with /account/v1/balance."""
+
+    def __init__(self, fetch_balance, reconcile_interval: float = 60):
+        self.fetch_balance = fetch_balance  # Returns the balance in cents or None on failure
+        self.reconcile_interval = reconcile_interval
+        self.confirmed = None  # Last balance from the api minus the buys since then
+        self.reserved = 0.0  # Buys in flight
+        self.spent = 0.0  # All successful buys, lets a reconcile account for buys finished while it was fetching
+        self.last_reconcile = None
+        self.reconciles = 0
+        self.failed_reconciles = 0
+        self._lock = threading.Lock()
+        self._reconciler = PeriodicTask("balance-reconcile", self.reconcile, reconcile_interval)
+
+    def reconcile(self) -> bool:
+        spent_before = self.spent
+        current_balance = self.fetch_balance()
+        if current_balance is None:
+            self.failed_reconciles += 1
+            return False
+        with self._lock:
+            # Buys in flight stay reserved, buys finished during the fetch may be missing from the api balance
+            self.confirmed = float(current_balance) - (self.spent - spent_before)
+            self.last_reconcile = time.time()
+        self.reconciles += 1
+        return True
+
+    def available(self) -> float:
+        with self._lock:
+            if self.confirmed is None:
+                return 0.0
+            return self.confirmed - self.reserved
+
+    def reserve(self, price: float) -> bool:
+        """Reserves price for a buy, False if the known balance is too low or was never fetched."""
+        if self.confirmed is None and not self.reconcile():
+            return False
+        with self._lock:
+            if self.confirmed - self.reserved < price:
+                return False
+            self.reserved += price
+            return True
+
+    def release(self, price: float, spent: bool):
+        """Ends a reservation, a successful buy is taken off the balance."""
+        with self._lock:
+            self.reserved = max(self.reserved - price, 0.0)
+            if spent:
+                self.spent += price
+                if self.confirmed is not None:
+                    self.confirmed -= price
+
+    def start(self):
+        self._reconciler.start()
+
+    def stop(self):
+        self._reconciler.stop()
+
+    def state(self) -> dict:
+        return {
+            "confirmed": self.confirmed,
+            "reserved": self.reserved,
+            "reconciles": self.reconciles,
+            "failed_reconciles": self.failed_reconciles,
+        }
@@ -0,0 +1,161 @@
+import concurrent.futures
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from config import db_path, catalog_checkpoint_path
+from db_writer import enable_wal
+from helpers import write_json_atomic
+from dmarketapi import get_offer_page_from_market, aggregated_prices, market_prices_ops, create_sales_table
+from iterate_DB import bad_words
+from ratelimit import PRIORITY_LOW
+
+
+# Price slices in cents, every slice is paged with its own cursor so the slices can be crawled concurrently
+price_slices = [0, 10, 25, 50, 100, 200, 350, 500, 1000, 2000, 5000, 10000, 50000, 100000000]
+crawler_workers = 4 #slices crawled at the same time, all requests go through the shared rate limiter
+crawler_page_size = 100 #offers per market/items page
+crawler_max_failures = 5 #failed pages in a row before a slice stops, it continues from its cursor next run
+crawler_retry_wait_in_s = 30 #first wait after a failed page, doubles per failure
+new_title_last_update = "2000-01-01 00:00:00" #stale on purpose, so the next refresh picks the new titles first
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CatalogCrawler:
+    """Pages through all market offers of a game by price slice and inserts every unknown title into sales.
+    The cursor of every slice is checkpointed after each page, so an interrupted crawl continues where it stopped."""
+
+    def __init__(self, db_path: str, checkpoint_path: str, game_id: str = "a8db", slices: list = price_slices,
+                 workers: int = crawler_workers, page_size: int = crawler_page_size):
+        self.db_path = db_path
+        self.checkpoint_path = checkpoint_path
+        self.game_id = game_id
+        self.slices = list(zip(slices[:-1], slices[1:]))
+        self.workers = workers
+        self.page_size = page_size
+        self.checkpoint = {}  # "from-to": {"cursor": str, "done": bool, "pages": int}
+        self.new_titles = set()
+        self.pages = 0
+        self.offers = 0
+        self.stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # One checkpoint write at a time, so an older state never replaces a newer one
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as file:
+                checkpoint = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load crawler checkpoint from {self.checkpoint_path}: {e}")
+            return
+        if checkpoint.get("game_id") == self.game_id:
+            self.checkpoint = checkpoint.get("slices", {})
+            logger.info(f"Continuing crawl, {sum(state['done'] for state in self.checkpoint.values())} of {len(self.slices)} slices done")
+
+    def save_checkpoint(self):
+        with self._lock:
+            data = {"game_id": self.game_id, "slices": dict(self.checkpoint)}
+        with self._save_lock:
+            write_json_atomic(self.checkpoint_path, data)
+
+    def store_page(self, offers: list) -> list:
+        """Inserts the unknown titles of one page with the cheapest offer and the offer count of the page as first stats."""
+        page_titles = {}
+        for offer in offers:
+            title = offer["title"]
+            if not title.strip() or any(bad_word in title.lower() for bad_word in bad_words):
+                continue
+            price = float(offer["price"]["USD"])
+            best_ask, count = page_titles.get(title, (price, 0))
+            page_titles[title] = (min(best_ask, price), count + 1)
+        if not page_titles:
+            return []
+
+        with sqlite3.connect(self.db_path) as conn:
+            enable_wal(conn)
+            cursor = conn.cursor()
+            cursor.executemany(
+                """
+                INSERT INTO sales (title, last_update, avg_min, avg_week, avg_month, avg_all_time, sales_month, avg_last_20_sales, offers_of_title, best_ask, ask_count)
+                VALUES (?, ?, 0, 0, 0, 0, 0, '0', NULL, ?, ?)
+                ON CONFLICT(title) DO NOTHING
+                """,
+                [(title, new_title_last_update, best_ask, count) for title, (best_ask, count) in page_titles.items()],
+            )
+            conn.commit()
+        return list(page_titles)
+
+    def crawl_slice(self, price_from: int, price_to: int):
+        key = f"{price_from}-{price_to}"
+        with self._lock:
+            state = self.checkpoint.setdefault(key, {"cursor": "", "done": False, "pages": 0})
+        failures = 0
+        while not state["done"] and not self.stop_event.is_set():
+            page = get_offer_page_from_market(
+                price_from, price_to, self.page_size, state["cursor"], self.game_id,
+                order_by="price", order_dir="asc", priority=PRIORITY_LOW,
+            )
+            if page is None:
+                # A failed page is not the end of the slice, the cursor stays and the page is tried again
+                failures += 1
+                if failures >= crawler_max_failures:
+                    logger.error(f"Slice {key} stopped after {failures} failed pages, it continues from the checkpoint next run")
+                    return
+                self.stop_event.wait(crawler_retry_wait_in_s * 2 ** (failures - 1))
+                continue
+            failures = 0
+            offers, cursor = page
+            titles = self.store_page(offers)
+            with self._lock:
+                self.new_titles.update(titles)
+                self.pages += 1
+                self.offers += len(offers)
+                state["cursor"] = cursor
+                state["pages"] += 1
+                state["done"] = not cursor or not offers
+            self.save_checkpoint()
+
+    def run(self) -> set:
+        """Crawls all slices that are not done yet, returns the titles seen in this run."""
+        start_time = time.time()
+        self.load_checkpoint()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.crawl_slice, price_from, price_to) for price_from, price_to in self.slices]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Crawling a price slice failed, it continues from the checkpoint next run: {e}")
+
+        if all(self.checkpoint.get(f"{price_from}-{price_to}", {}).get("done") for price_from, price_to in self.slices):
+            if os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)  # Complete, the next run starts a fresh crawl
+        logger.info(f"Crawled {self.pages} pages with {self.offers} offers and {len(self.new_titles)} titles in {time.time() - start_time:.2f} seconds")
+        return self.new_titles
+
+
+def crawl():
+    create_sales_table()
+    crawler = CatalogCrawler(db_path, catalog_checkpoint_path)
+    titles = crawler.run()
+
+    # Best ask and bid with their counts for the crawled titles in a few bulk requests
+    prices = aggregated_prices(sorted(titles))
+    with sqlite3.connect(db_path) as conn:
+        enable_wal(conn)
+        ops = market_prices_ops(prices)
+        if ops:
+            conn.executemany(ops[0][0], [params for sql, params in ops])
+        conn.commit()
+    logger.info(f"Aggregated prices stored for {len(prices)} titles")
+
+
+if __name__ == "__main__":
+    crawl()
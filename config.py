@@ -12,6 +12,8 @@ offer_list_directory = os.path.join(os.path.expanduser("~"), "OneDrive", "Dokume
 db_append_directory = os.path.join(os.path.expanduser("~"), "OneDrive", "Dokumente", "_projects", "api", "dmarket_api", "Bot_and_DB", "lists", "db_append_lists")
 no_data_titles_path = os.path.join(os.path.expanduser("~"), "OneDrive", "Dokumente", "_projects", "api", "dmarket_api", "Bot_and_DB", "lists", "db_append_lists", "no_data_titles.txt")
 db_path = os.path.join(os.path.expanduser("~"), "OneDrive", "Dokumente", "_projects", "api", "dmarket_api", "Bot_and_DB", "sales_data.db")
+processed_offers_path = os.path.join(os.path.expanduser("~"), "OneDrive", "Dokumente", "_projects", "api", "dmarket_api", "Bot_and_DB", "lists", "processed_offers.json")
+catalog_checkpoint_path = os.path.join(os.path.expanduser("~"), "OneDrive", "Dokumente", "_projects", "api", "dmarket_api", "Bot_and_DB", "lists", "catalog_checkpoint.json")
 
 #for Test
 #db_path = os.path.join(os.path.expanduser("~"), "OneDrive", "Dokumente", "_projects", "api", "dmarket_api", "test", "test_for_Main", "sales_data.db") #for test_for_main
@@ -22,15 +24,49 @@ db_path = os.path.join(os.path.expanduser("~"), "OneDrive", "Dokumente", "_proje
 #db_append_directory = os.path.join(os.path.expanduser("~"),"Bot_and_DB", "lists", "db_append_lists") #for pi
 #no_data_titles_path = os.path.join(os.path.expanduser("~"), "Bot_and_DB", "lists", "db_append_lists", "no_data_titles.txt")  # for pi
 #db_path = os.path.join(os.path.expanduser("~"), "Bot_and_DB", "sales_data.db")  # for pi
+#processed_offers_path = os.path.join(os.path.expanduser("~"), "Bot_and_DB", "lists", "processed_offers.json")  # for pi
+#catalog_checkpoint_path = os.path.join(os.path.expanduser("~"), "Bot_and_DB", "lists", "catalog_checkpoint.json")  # for pi
 
 #"C:\\Users\\fritz\\OneDrive\\Dokumente\\_projects\\dmarket_api\\py\\Dmarket\\offer_lists"
 
-# Get the current timestamp in a more readable format
-timestamp =  datetime.now().strftime("%S-%M-%H-%d_%m-%Y") 
-#timestamp =  datetime.now().strftime("%Y-%m-%d_%H-%M-%S") #Timetamp with other arrangement 
+# Get the current timestamp in a more readable format, computed on first access (e.g. "from config import timestamp") and then kept
+def __getattr__(name):
+    if name == "timestamp":
+        value = datetime.now().strftime("%S-%M-%H-%d_%m-%Y")
+        #value =  datetime.now().strftime("%Y-%m-%d_%H-%M-%S") #Timetamp with other arrangement 
+        globals()["timestamp"] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 
 
 url_get_items = "/exchange/v1/market/items"
 
+#HTTP client
+http_pool_size = 20 #connections kept alive to the api, should be >= the number of worker threads
+api_call_retries = 20 #urllib3 retries on 5xx for api_call (buys, listings, inventory)
+hot_path_retries = 2 #urllib3 retries on 5xx for the sniping feed, buys and governed_get (balance, refresh reads), they must not hang in an outage
+hot_path_attempts = 2 #api_call attempts of the sniping feed and buys before they give up, other calls keep retrying
+request_timeouts = {"GET": 30, "POST": 10, "PATCH": 10} #default timeout in seconds per method
+endpoint_timeouts = { #timeout in seconds for single endpoints, overrides the method default
+    "/exchange/v1/market/items": 10,
+    "/exchange/v1/offers-buy": 10,
+    "/account/v1/balance": 10,
+    "/exchange/v1/customized-fees": 60,
+}
+
+#Rate limits, path prefix: (requests per second, burst). Corrected at runtime from the RateLimit-* headers
+rate_limit_families = {
+    "/exchange/v1/market/items": (10, 10),
+    "/exchange/v1/offers-buy": (5, 5),
+    "/exchange/v1/offers-by-title": (6, 6),
+    "/trade-aggregator": (6, 6),
+    "/account": (5, 5),
+    "/marketplace-api": (6, 6),
+    "/price-aggregator": (6, 6),
+    "default": (10, 10),
+}
+fee_cache_refresh_in_s = 3600 #how often the reduced fees are pulled from the api and reloaded into memory
+rate_limit_priority_reserve = 0.2 #share of each bucket only buys and the sniping feed may use
+
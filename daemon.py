@@ -0,0 +1,146 @@
+import logging
+import signal
+import threading
+import time
+
+import iterate_DB
+import main
+from dmarketapi import get_fee, markdown_items, sync_pending_inventory
+from fee_cache import fee_cache
+
+
+# Intervals of the periodic sub-tasks
+markdown_interval_in_h = 24
+inventory_sync_interval_in_h = 1
+market_prices_interval_in_h = 0.5  # Bulk best ask / best bid refresh, flags the titles the sales refresh should take first
+new_titles_interval_in_h = 0.5  # Titles the sniper saw without sales data are added to the sales table
+restart_backoff_in_s = 30  # Wait before a crashed task is started again, doubles up to 10 minutes
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Task:
+    """One sub-task of the daemon. Without an interval the target is long running and restarted when it returns or crashes."""
+
+    def __init__(self, name: str, target, interval_in_s: float = None):
+        self.name = name
+        self.target = target
+        self.interval_in_s = interval_in_s
+        self.runs = 0
+        self.failures = 0
+        self.last_error = None
+        self.thread = None
+
+
+class Supervisor:
+    def __init__(self):
+        self.tasks = []
+        self.stop_event = threading.Event()
+
+    def add(self, name: str, target, interval_in_s: float = None):
+        self.tasks.append(Task(name, target, interval_in_s))
+
+    def _run_task(self, task: Task):
+        backoff = restart_backoff_in_s
+        while not self.stop_event.is_set():
+            try:
+                task.runs += 1
+                task.target()
+                backoff = restart_backoff_in_s
+                wait = task.interval_in_s if task.interval_in_s is not None else 0
+            except Exception as e:
+                task.failures += 1
+                task.last_error = repr(e)
+                logger.exception(f"Task {task.name} failed, restarting in {backoff} seconds")
+                wait = backoff
+                backoff = min(backoff * 2, 600)
+            if self.stop_event.wait(wait):
+                break
+
+    def start(self):
+        for task in self.tasks:
+            task.thread = threading.Thread(target=self._run_task, args=(task,), name=task.name, daemon=True)
+            task.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def state(self) -> dict:
+        return {
+            task.name: {
+                "alive": task.thread is not None and task.thread.is_alive(),
+                "runs": task.runs,
+                "failures": task.failures,
+                "last_error": task.last_error,
+            }
+            for task in self.tasks
+        }
+
+
+def warm_up():
+    """Startup phase: tables, fees and the price index are prepared once for all sub-tasks."""
+    iterate_DB.startup()
+    main.startup()  # Also pulls the fees and loads the fee cache and the price index
+    iterate_DB.add_titles_from_file()
+    iterate_DB.load_latest_dates()
+    iterate_DB.start_sales_writer()  # One writer connection for the whole lifetime of the daemon
+
+
+def run():
+    warm_up()
+    market_offers = main.MarketOffers()  # Kept across restarts of the sniping task, so seen offers stay known
+    supervisor = Supervisor()
+
+    def snipe():
+        market_offers.stop_thread = False
+        market_offers.process_offers_with_pagination(run_hours=None)
+
+    def refresh():
+        iterate_DB.stop_event.clear()
+        iterate_DB.run_continuous_refresh()
+
+    def add_new_titles():
+        # Same hand over as the cron cycle, through no_data_titles_path
+        titles = set(market_offers.no_data_titles)
+        if not titles:
+            return
+        market_offers.save_no_data_titles()
+        iterate_DB.add_titles_from_file()
+        market_offers.no_data_titles -= titles
+
+    supervisor.add("sniping", snipe)
+    supervisor.add("sales-refresh", refresh)
+    supervisor.add("markdown", markdown_items, markdown_interval_in_h * 60 * 60)
+    supervisor.add("inventory-sync", sync_pending_inventory, inventory_sync_interval_in_h * 60 * 60)
+    supervisor.add("new-titles", add_new_titles, new_titles_interval_in_h * 60 * 60)
+    if iterate_DB.use_market_prices:
+        supervisor.add("market-prices", iterate_DB.refresh_market_prices, market_prices_interval_in_h * 60 * 60)
+
+    def shutdown(sig, frame):
+        logger.info("Stopping daemon")
+        supervisor.stop()
+        market_offers.stop_thread = True
+        iterate_DB.stop_event.set()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    # The in-memory caches refresh themselves, the fee sync runs inside the fee cache thread
+    main.price_index.start()
+    fee_cache.start(sync_fees=get_fee)
+    supervisor.start()
+
+    while not supervisor.stop_event.wait(600):
+        logger.info(f"Daemon state: {supervisor.state()}")
+
+    for task in supervisor.tasks:
+        task.thread.join(timeout=60)
+    market_offers.save_offers()
+    iterate_DB.stop_sales_writer()
+    main.price_index.stop()
+    fee_cache.stop()
+
+
+if __name__ == "__main__":
+    run()
@@ -1,4 +1,6 @@
-from dmarketapi import markdown_items
+import sys
 
-markdown_items()
-#in markdown muss noch ein return hinterlegt werden (ob items bearbeitet wurden), wenn dieser Positiv sind, muss noch der Endpoint zur Preis Anpassung gecalled werden
\ No newline at end of file
+from dmarketapi import reprice_items
+
+if __name__ == "__main__":
+    reprice_items(dry_run="--dry-run" in sys.argv)  # --dry-run only prints the new prices
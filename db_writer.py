@@ -0,0 +1,135 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def enable_wal(conn: sqlite3.Connection):
+    # WAL lets main.py keep reading while the refresh writes, the setting is stored in the db file
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=10000")
+
+
+class DBWriter:
+    """Single connection writer thread. Worker threads submit statements, which are flushed
+    with executemany in one transaction every batch_rows statements or flush_interval_ms."""
+
+    def __init__(self, db_path: str, batch_rows: int = 500, flush_interval_ms: int = 250):
+        self.db_path = db_path
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval_ms / 1000
+        self.queue = queue.Queue()
+        self.written_units = 0
+        self.failed_units = 0
+        self.flushes = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, ops, on_commit=None):
+        """Queues one unit of work, a list of (sql, params) that is always committed together.
+        on_commit is called in the writer thread once the unit is committed, never for a dropped unit."""
+        self.queue.put((ops, on_commit))
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until everything submitted so far is committed, returns False on timeout."""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """Flushes everything still queued and stops the writer thread."""
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        enable_wal(conn)
+        pending = []
+        pending_rows = 0
+        deadline = None
+        stop = False
+        flushed = None
+        try:
+            while not stop:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                try:
+                    unit = self.queue.get(timeout=timeout)
+                    if unit is None:
+                        stop = True
+                    elif isinstance(unit, threading.Event):
+                        flushed = unit
+                    else:
+                        if deadline is None:
+                            deadline = time.monotonic() + self.flush_interval
+                        pending.append(unit)
+                        pending_rows += len(unit[0])
+                except queue.Empty:
+                    pass
+
+                if pending and (stop or flushed is not None or pending_rows >= self.batch_rows or time.monotonic() >= deadline):
+                    self._flush(conn, pending)
+                    pending = []
+                    pending_rows = 0
+                    deadline = None
+                if flushed is not None:
+                    flushed.set()
+                    flushed = None
+        finally:
+            conn.close()
+
+    def _flush(self, conn, units):
+        committed = []
+        try:
+            self._execute(conn, [ops for ops, on_commit in units])
+            committed = units
+        except sqlite3.Error as e:
+            # Retry unit by unit so one bad row does not drop the whole batch
+            logger.error(f"Batch write of {len(units)} units failed, retrying one by one: {e}")
+            for unit in units:
+                try:
+                    self._execute(conn, [unit[0]])
+                    committed.append(unit)
+                except sqlite3.Error as e:
+                    logger.error(f"Write failed for {unit[0][0][0][:40]}...: {e}")
+                    self.failed_units += 1
+        self.written_units += len(committed)
+        self.flushes += 1
+        for ops, on_commit in committed:
+            if on_commit is not None:
+                try:
+                    on_commit()
+                except Exception as e:
+                    logger.error(f"Commit callback failed: {e}")
+
+    @staticmethod
+    def _execute(conn, units):
+        # Consecutive statements with the same sql are merged into one executemany, order is kept
+        batches = []
+        for unit in units:
+            for sql, params in unit:
+                if batches and batches[-1][0] == sql:
+                    batches[-1][1].append(params)
+                else:
+                    batches.append((sql, [params]))
+        conn.execute("BEGIN")
+        try:
+            for sql, params_list in batches:
+                conn.executemany(sql, params_list)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
@@ -1,50 +1,32 @@
-import json
-from datetime import datetime, timedelta
+# Annotations stay strings, so numpy and the pydantic schemas are only imported by the functions that use them
+from __future__ import annotations
+
+import concurrent.futures
+from datetime import datetime, timedelta, timezone
 import time
+import threading
+from urllib.parse import urlsplit
 
-from nacl.bindings import crypto_sign
 import requests
 import urllib3
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
 
 import sqlite3
-import numpy as np
 
 # from pynput import keyboard
-from pytz import utc
-
-from furl import furl
-from pydantic import BaseModel
 import logging
+from collections import Counter
 from typing import List, Union
 
 
 from credentials import PUBLIC_KEY, SECRET_KEY
-from config import API_URL, API_URL_TRADING, db_path
-from schemas import (
-    Balance,
-    Games,
-    LastSales,
-    LastSale,
-    SalesHistory,
-    MarketOffers,
-    AggregatedTitle,
-    UserTargets,
-    ClosedTargets,
-    Target,
-    UserItems,
-    CreateOffers,
-    CreateOffersResponse,
-    EditOffers,
-    EditOffersResponse,
-    DeleteOffers,
-    CreateTargets,
-    CumulativePrices,
-    OfferDetails,
-    OfferDetailsResponse,
-    ClosedOffers,
-)
+from config import API_URL, API_URL_TRADING, db_path, http_pool_size, request_timeouts, endpoint_timeouts, api_call_retries, hot_path_retries, hot_path_attempts
+from db_writer import enable_wal
+from fee_cache import fee_cache
+from ratelimit import rate_limiter, PRIORITY_HIGH, PRIORITY_LOW
+from refresh_scheduler import decayed_hits
+from signing import RequestSigner, encode_body
 
 
 # Globals
@@ -62,25 +44,59 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # Set logging level to ERROR to suppress warnings
 logging.getLogger("urllib3").setLevel(logging.ERROR)
 
+# Shared HTTP sessions, one per retry policy, created once so every endpoint reuses pooled keep-alive connections
+_sessions = {}
+_session_lock = threading.Lock()
+
+
+def get_session(retries: int = hot_path_retries) -> requests.Session:
+    session = _sessions.get(retries)
+    if session is None:
+        with _session_lock:
+            session = _sessions.get(retries)
+            if session is None:
+                session = requests.Session()
+                retry = Retry(
+                    total=retries,  # Number of retries
+                    backoff_factor=1,  # Time to wait between retries
+                    status_forcelist=[500, 502, 503, 504],  # Retry on these status codes, 403/429 go through the rate limiter
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=4,  # Number of hosts to keep pools for
+                    pool_maxsize=http_pool_size,  # Connections kept alive per host
+                    max_retries=retry,
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({"Connection": "keep-alive"})
+                _sessions[retries] = session
+    return session
+
+
+def get_timeout(url: str, method: str = "GET") -> float:
+    url_path = urlsplit(url).path
+    if url_path in endpoint_timeouts:
+        return endpoint_timeouts[url_path]
+    return request_timeouts.get(method, request_timeouts["GET"])
+
+
+# GET through the shared session, waiting for the rate limiter and feeding it the response headers
+def governed_get(url: str, params: dict = None, headers: dict = None, priority: int = PRIORITY_LOW):
+    rate_limiter.acquire(url, priority)
+    response = get_session().get(url, params=params, headers=headers, timeout=get_timeout(url))
+    rate_limiter.update_from_headers(url, response.headers)
+    if response.status_code in (403, 429):
+        rate_limiter.penalize(url, response.headers)
+    return response
+
+
+signer = RequestSigner(PUBLIC_KEY, SECRET_KEY)
+
+
 def generate_headers(
     method: str, api_path: str, params: dict = None, body: dict = None
 ) -> dict:
-    nonce = str(round(datetime.now().timestamp()))
-    string_to_sign = method + api_path
-    string_to_sign = str(furl(string_to_sign).add(params))
-    if body:
-        string_to_sign += json.dumps(body)
-    string_to_sign += nonce
-    signature_prefix = "dmar ed25519 "
-    encoded = string_to_sign.encode("utf-8")
-    signature_bytes = crypto_sign(encoded, bytes.fromhex(SECRET_KEY))
-    signature = signature_bytes[:64].hex()
-    headers = {
-        "X-Api-Key": PUBLIC_KEY,
-        "X-Request-Sign": signature_prefix + signature,
-        "X-Sign-Date": nonce,
-    }
-    return headers
+    return signer.sign(method, api_path, params, body)
 
 
 def api_call(
@@ -90,57 +106,51 @@ def api_call(
     params: dict = None,
     body: dict = None,
     aio: bool = True,
+    timeout: float = None,
+    priority: int = PRIORITY_LOW,
+    max_throttle_retries: int = 5,
+    retries: int = api_call_retries,
+    max_attempts: int = None,
 ) -> dict:
-
-    session = requests.Session()
-    retry = Retry(
-        total=20,  # Number of retries
-        backoff_factor=1,  # Time to wait between retries
-        status_forcelist=[403, 500, 502, 503, 504],  # Retry on these status codes
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
+    """retries is the urllib3 retry policy on 5xx, max_attempts ends the retry loop with None (None retries forever)."""
+    session = get_session(retries)
+    if timeout is None:
+        timeout = get_timeout(url, method)
 
     backoff_time = 5  # Initial backoff time in seconds
+    throttle_retries = 0
+    attempts = 0
+    data = None
+    if body is not None:
+        # Send the same bytes that were signed instead of letting requests serialize the body again
+        data = encode_body(body)
+        headers = {**headers, "Content-Type": "application/json"}
 
     while True:
+        attempts += 1
         try:
+            rate_limiter.acquire(url, priority)
             if method == "GET":
                 response = session.get(
-                    url, params=params, headers=headers, timeout=30
-                )  # Increase timeout if needed
+                    url, params=params, headers=headers, timeout=timeout
+                )  # Timeouts are set per endpoint in config.py
             elif method == "POST":
                 response = session.post(
-                    url, json=body, headers=headers, timeout=10
-                )  # Example for POST request
+                    url, data=data, headers=headers, timeout=timeout
+                )
             elif method == "PATCH":
-                response = session.patch(url, json=body, headers=headers, timeout=10)
+                response = session.patch(url, data=data, headers=headers, timeout=timeout)
+
+            # The shared rate limiter learns the budget of the endpoint family from the headers,
+            # so all threads slow down together instead of only the one that hit the limit
+            rate_limiter.update_from_headers(url, response.headers)
+            if response.status_code in (403, 429):
+                rate_limiter.penalize(url, response.headers)
+                throttle_retries += 1
+                if throttle_retries <= max_throttle_retries:
+                    continue
             response.raise_for_status()  # Raise an exception for HTTP errors
 
-            # Print rate limit headers
-            rate_limit_remaining = int(response.headers.get("RateLimit-Remaining", 1))
-            rate_limit_reset = int(response.headers.get("RateLimit-Reset", 1))
-            rate_limit_limit = int(response.headers.get("RateLimit-Limit", 1))
-            # print("request start")
-            # logger.info(f"Updated item: {params.get('title', 'Unknown Title')}")
-            # print("X-RateLimit-Limit-Second:", response.headers.get("X-RateLimit-Limit-Second"))
-            # print("X-RateLimit-Remaining-Second:", response.headers.get("X-RateLimit-Remaining-Second"))
-            # print("RateLimit-Remaining:", rate_limit_remaining)
-            # print("RateLimit-Limit:", rate_limit_limit)
-            # print("RateLimit-Reset:", rate_limit_reset)
-            # print("request end")
-
-            # Fallback mechanism for missing headers
-            if rate_limit_remaining is None or rate_limit_reset is None:
-                rate_limit_remaining = 1
-                rate_limit_reset = 1
-
-            # Wait if rate limit is reached
-            if rate_limit_remaining == 0:
-                #print(f"Rate limit reached. Waiting for {rate_limit_reset} seconds...") #bloats the output only for debugging
-                time.sleep(rate_limit_reset)
-
             # Check if response is empty
             if not response.text:
                 print("Empty response received")
@@ -159,11 +169,15 @@ def api_call(
         except requests.exceptions.RequestException as e:
             #logger.info(f"Making API call with params: {params}")  # Log the parameters
             print(f"An error occurred: {e}")
-            #print(f"Retrying in {backoff_time} seconds...")
-            time.sleep(backoff_time)  # Wait before retrying
-            backoff_time = min(
-                backoff_time * 2, 300
-            )  # Exponential backoff with a maximum wait time of 5 minutes
+            if max_attempts is None or attempts < max_attempts:
+                #print(f"Retrying in {backoff_time} seconds...")
+                time.sleep(backoff_time)  # Wait before retrying
+                backoff_time = min(
+                    backoff_time * 2, 300
+                )  # Exponential backoff with a maximum wait time of 5 minutes
+        if max_attempts is not None and attempts >= max_attempts:
+            print(f"Giving up on {url} after {attempts} attempts")
+            break
 
 
 ##############
@@ -173,34 +187,82 @@ def api_call(
 
 # get offers from the market
 def get_offer_from_market(min_item_price: int, max_item_price: int) -> List[dict]:
+    page = get_offer_page_from_market(min_item_price, max_item_price)
+    return page[0] if page is not None else []
+
+
+# One page of the newest offers, the returned cursor continues with older ones. None if the request failed
+def get_offer_page_from_market(
+    min_item_price: int, max_item_price: int, limit: int = 5, cursor: str = "", game_id: str = "a8db",
+    order_by: str = "updated", order_dir: str = "desc", priority: int = PRIORITY_HIGH,
+) -> tuple:
     url_path = "/exchange/v1/market/items"
     url = API_URL + url_path
     params = {
-        "gameId": "a8db",
-        "limit": 5,  # 5 if price filter / 10 if no price filter
+        "gameId": game_id,
+        "limit": limit,  # 5 if price filter / 10 if no price filter
         "offset": 0,
-        "orderBy": "updated",
-        "orderDir": "desc",
+        "orderBy": order_by,
+        "orderDir": order_dir,
         "treeFilters": "",
         "currency": "USD",
         "priceFrom": min_item_price,
         "priceTo": max_item_price,
-        "cursor": "",
+        "cursor": cursor,
     }
     method = "GET"
-    headers = generate_headers(method, url_path, params)
 
     while True:
         try:
             # print("get_offer_from_market")
-            response = api_call(url, method, headers, params)
-            offers = response.get("objects", [])
-            return offers
+            headers = generate_headers(method, url_path, params)
+            response = api_call(url, method, headers, params, priority=priority, retries=hot_path_retries, max_attempts=hot_path_attempts)
+            if response is None:
+                return None  # Failed, unlike ([], "") at the end of the offers
+            return response.get("objects", []), response.get("cursor", "")
         except requests.exceptions.RequestException as e:
             print(f"An error occurred in fetching new items: {e}")
             time.sleep(60)  # Wait for 1 minute before retrying
 
 
+aggregated_prices_chunk = 100  # Titles per aggregated-prices request
+
+
+# Best ask and best bid with their counts for many titles per request
+def aggregated_prices(titles: List[str], game_id: str = "a8db") -> dict:
+    """title: (best ask in cents, ask count, best bid in cents, bid count) for the titles the api knows."""
+    method = "GET"
+    url_path = "/price-aggregator/v1/aggregated-prices"
+    url = API_URL + url_path
+    prices = {}
+    for start in range(0, len(titles), aggregated_prices_chunk):
+        chunk = titles[start:start + aggregated_prices_chunk]
+        params = {"GameID": game_id, "Titles": chunk, "Limit": len(chunk)}
+        headers = generate_headers(method, url_path, params)
+        response = api_call(url, method, headers, params)
+        if not response or "AggregatedTitles" not in response:
+            logging.error(f"Failed to get aggregated prices for {len(chunk)} titles")
+            continue
+        for aggregated in response["AggregatedTitles"]:
+            offers = aggregated.get("Offers") or {}
+            orders = aggregated.get("Orders") or {}
+            prices[aggregated["MarketHashName"]] = (
+                round(float(offers.get("BestPrice") or 0) * 100),
+                int(offers.get("Count") or 0),
+                round(float(orders.get("BestPrice") or 0) * 100),
+                int(orders.get("Count") or 0),
+            )
+    return prices
+
+
+def market_prices_ops(prices: dict) -> list:
+    """Statements writing aggregated_prices results into the sales table."""
+    return [
+        ("UPDATE sales SET best_ask = ?, ask_count = ?, best_bid = ?, bid_count = ? WHERE title = ?", (*values, title))
+        for title, values in prices.items()
+    ]
+
+
 # Endpoint for receiving a response for recent sales.
 # test last_sales
 def last_sales(
@@ -212,6 +274,7 @@ def last_sales(
     end_date: datetime = None,
 ) -> LastSales:
     """Method for receiving and processing a response for recent sales."""
+    from schemas import LastSales
 
     method = "GET"
     params = {"gameId": gameId, "title": title, "limit": limit, "offset": offset}
@@ -226,16 +289,58 @@ def last_sales(
     sales = LastSales(**response)
 
     if start_date is not None:
-        start_date = start_date.replace(tzinfo=utc)
+        start_date = start_date.replace(tzinfo=timezone.utc)
         sales.sales = [sale for sale in sales.sales if sale.date >= start_date]
 
     if end_date is not None:
-        end_date = end_date.replace(tzinfo=utc)
+        end_date = end_date.replace(tzinfo=timezone.utc)
         sales.sales = [sale for sale in sales.sales if sale.date <= end_date]
 
     return sales
 
 
+# Fast path for the bulk refresh, decodes the sales straight into columns without Pydantic models
+def parse_sale_timestamps(dates: list) -> np.ndarray:
+    import numpy as np
+    try:
+        return np.array(dates, dtype=np.float64).astype(np.int64)  # Unix seconds, as number or string
+    except ValueError:
+        return np.array(
+            [int(datetime.fromisoformat(date.replace("Z", "+00:00")).timestamp()) for date in dates],
+            dtype=np.int64,
+        )
+
+
+def parse_last_sales_columns(response: dict, validate: bool = False) -> tuple:
+    """Returns (timestamps as int64, prices in cents as float64) of a last-sales response."""
+    import numpy as np
+    if validate:
+        from schemas import LastSales
+        sales = LastSales(**response).sales
+        timestamps = np.array([int(sale.date.timestamp()) for sale in sales], dtype=np.int64)
+        prices = np.array([float(sale.price) for sale in sales], dtype=np.float64)
+    else:
+        sales = response["sales"]
+        timestamps = parse_sale_timestamps([sale["date"] for sale in sales])
+        prices = np.array([sale["price"] for sale in sales], dtype=np.float64)
+    return timestamps, np.round(prices * 100, 2)
+
+
+def last_sales_columns(
+    gameId: str, title: str, limit: str, offset: str = "0", validate: bool = False
+) -> tuple:
+    method = "GET"
+    params = {"gameId": gameId, "title": title, "limit": limit, "offset": offset}
+    url_path = "/trade-aggregator/v1/last-sales"
+    headers = generate_headers(method, url_path, params)
+    url = API_URL_TRADING + url_path
+    response = api_call(url, method, headers, params)
+    if not response or "sales" not in response:
+        print(f"Invalid response for title: {title}")
+        return None  # Failed, unlike the empty arrays of a title without sales
+    return parse_last_sales_columns(response, validate)
+
+
 # Endpoint to get offers for one title
 
 
@@ -273,13 +378,79 @@ def offers_by_title(title: str, limit: str) -> tuple:
     return all_offers, cursor
 
 
+def offer_prices_by_title(title: str, limit: str) -> np.ndarray:
+    """Only the prices in cents of offers_by_title, the offer dicts of a page are dropped right away."""
+    import numpy as np
+    method = "GET"
+    cursor = ""
+    prices = []
+
+    while True:
+        params = {"title": title, "limit": limit, "Cursor": cursor}
+        url_path = "/exchange/v1/offers-by-title"
+        headers = generate_headers(method, url_path, params)
+        url = API_URL_TRADING + url_path
+
+        response = api_call(url, method, headers, params)
+        if response is None:
+            logging.error(f"Failed to get response for title: {title}")
+            break
+
+        prices.extend(offer["price"]["USD"] for offer in response.get("objects", []))
+
+        if response.get("cursor") and len(prices) >= 100:
+            cursor = response["cursor"]
+        else:
+            break
+
+    return np.array(prices, dtype=np.float64)
+
+
+def ladder_from_levels(levels: List[dict]) -> List[tuple]:
+    """Cumulative price levels to (price in cents, amount at this price) tuples."""
+    ladder = []
+    previous = 0
+    for level in sorted(levels, key=lambda level: level["Level"]):
+        amount = int(level["Amount"])
+        ladder.append((round(float(level["Price"]) * 100), amount - previous))
+        previous = amount
+    if any(amount < 0 for price, amount in ladder):
+        # Amounts were not cumulative, keep them as they are
+        ladder = [(round(float(level["Price"]) * 100), int(level["Amount"])) for level in levels]
+    amounts = {}
+    for price, amount in ladder:
+        if amount > 0:
+            amounts[price] = amounts.get(price, 0) + amount  # Levels can round to the same cent
+    return sorted(amounts.items())
+
+
+def parse_order_book(response: dict) -> tuple:
+    return ladder_from_levels(response.get("Offers") or []), ladder_from_levels(response.get("Targets") or [])
+
+
+# Aggregated depth of one title, replaces paging through offers-by-title
+def order_book_by_title(title: str, game_id: str = "a8db"):
+    """(asks, bids) as (price in cents, amount) tuples, None if the request failed."""
+    method = "GET"
+    params = {"Title": title, "GameID": game_id}
+    url_path = "/marketplace-api/v1/cumulative-price-levels"
+    headers = generate_headers(method, url_path, params)
+    url = API_URL_TRADING + url_path
+
+    response = api_call(url, method, headers, params)
+    if response is None:
+        logging.error(f"Failed to get order book for title: {title}")
+        return None
+    return parse_order_book(response)
+
+
 def buy_item(offer_id: str, price: float) -> dict:
     method = "PATCH"
     url_path = "/exchange/v1/offers-buy"
     body = build_buy_body_from_offer(offer_id, price)
     headers = generate_headers(method, url_path, body=body)
     url = API_URL_TRADING + url_path
-    response = api_call(url, method, headers, body=body)
+    response = api_call(url, method, headers, body=body, priority=PRIORITY_HIGH, retries=hot_path_retries, max_attempts=hot_path_attempts)
     print(response)
     # Extracting only the required fields
     result = {"orderId": response.get("orderId"), "status": response.get("status")}
@@ -292,7 +463,11 @@ def balance():
     url_path = "/account/v1/balance"
     headers = generate_headers(method, url_path)
     url = API_URL_TRADING + url_path
-    response = requests.get(url, headers=headers)
+    try:
+        response = governed_get(url, headers=headers, priority=PRIORITY_HIGH)
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to get balance: {e}")
+        return None
 
     if response.status_code == 200:
         data = response.json()
@@ -303,126 +478,167 @@ def balance():
         return None
 
 
-def get_inventory(timestamp_to_set):
-    print("get_inventory startet")  # delete
-    set_timestamp = timestamp_to_set
-    all_items = []
-    offset = 0
+inventory_page_size = 50  # Limit per user-inventory page
+inventory_fetch_workers = 4  # Pages after the first are fetched concurrently
+pending_inventory_max_age_in_h = 14 * 24  # Purchases whose item never showed up (cancelled, refunded) are no longer synced after this
+
 
+def get_inventory_page(offset: int, limit: int = inventory_page_size):
+    """One page of the user inventory, None if all retries failed."""
     method = "GET"
     params = {
         "gameId": "a8db",
         "currency": "USD",
         "BasicFilters.InMarket": True,
         "offset": offset,
-        "Limit": 50,
+        "Limit": limit,
     }
     url_path = "/marketplace-api/v1/user-inventory"
     url = API_URL_TRADING + url_path
 
-    while True:
-        for attempt in range(6):  # Try up to 6 times
-            headers = generate_headers(method, url_path, params)
-            response = requests.get(url, params=params, headers=headers)
+    for attempt in range(6):  # Try up to 6 times
+        headers = generate_headers(method, url_path, params)
+        try:
+            response = governed_get(url, params=params, headers=headers)
+        except requests.exceptions.RequestException as e:
+            print(f"Attempt {attempt + 1}: Request failed: {e}")
+            response = None
+
+        if response is not None and response.status_code == 200:
+            try:
+                data = response.json()
+            except ValueError:
+                print("Error: Unable to parse JSON response")
+                print("Response text:", response.text)
+                return None
+            if "Items" not in data:
+                print("Key 'Items' not found in response data")
+                return None
+            return data
 
-            if response.status_code == 200:
-                break
-            else:
-                print(
-                    f"Attempt {attempt + 1}: Received status code {response.status_code}"
-                )
-                if attempt < 5:
-                    time.sleep(2)  # Wait for 2 seconds before retrying
-                else:
-                    print("Max retries reached. Exiting.")
-                    return all_items
+        if response is not None:
+            print(f"Attempt {attempt + 1}: Received status code {response.status_code}")
+        if attempt < 5:
+            time.sleep(2)  # Wait for 2 seconds before retrying
+    print(f"Max retries reached for inventory offset {offset}.")
+    return None
 
-        try:
-            data = response.json()
-            print(f"data: {data}")# to delete
-        except ValueError:
-            print("Error: Unable to parse JSON response")
-            print("Response text:", response.text)
-            break
-        # Check if 'objects' key exists in the response data
-        if "Items" not in data:
-            print("Key 'objects' not found in response data")
-            break
 
-        # Extract classId and title
+def fetch_inventory_items() -> List[dict]:
+    """All inventory items, the first page tells the total and the remaining pages are fetched concurrently."""
+    first_page = get_inventory_page(0)
+    if first_page is None:
+        return []
+    pages = [first_page]
+    total = int(first_page.get("Total", 0))
+    offsets = range(inventory_page_size, total, inventory_page_size)
+    if offsets:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=inventory_fetch_workers) as executor:
+            for data in executor.map(get_inventory_page, offsets):
+                if data is None:
+                    print("Inventory page missing, items on it are synced on the next run")
+                    continue
+                pages.append(data)
+
+    items = []
+    for data in pages:
         for item in data["Items"]:
-            class_id = item.get("ClassID")
-            timed_classId_listings = f"{set_timestamp}_{class_id}"
-            title = item.get("Title")
-            asset_id = item.get("AssetID")
-            
-            
-            all_items.append(
-                {
-                    "timed_classId_listings": timed_classId_listings,
-                    "title": title,
-                    "assetId": asset_id,
-                }
+            items.append({"classId": item.get("ClassID"), "title": item.get("Title"), "assetId": item.get("AssetID")})
+    return items
+
+
+def reconcile_inventory(items: List[dict], timestamps: List[str], purchases_only: bool = False):
+    """Adds the inventory items to listings for every purchase timestamp and copies the prices of matching
+    bought_items, all set-based in one transaction through a staging table. With purchases_only an item is
+    only added where timestamp and classId match a purchase."""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        enable_wal(conn)
+        cursor = conn.cursor()
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS inventory_staging (position INTEGER PRIMARY KEY, class_id TEXT, title TEXT, asset_id TEXT)")
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS sync_timestamps (timestamp TEXT PRIMARY KEY)")
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute("DELETE FROM inventory_staging")
+            cursor.execute("DELETE FROM sync_timestamps")
+            cursor.executemany(
+                "INSERT INTO inventory_staging (class_id, title, asset_id) VALUES (?, ?, ?)",
+                [(item["classId"], item["title"], item["assetId"]) for item in items],
             )
+            cursor.executemany("INSERT OR IGNORE INTO sync_timestamps (timestamp) VALUES (?)", [(ts,) for ts in timestamps])
 
-            # Check if the item already exists in the listings table
-            with sqlite3.connect(db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                SELECT COUNT(*) FROM listings WHERE timed_classId_listings = ?
-                """,
-                    (timed_classId_listings,),
-                )
-                count = cursor.fetchone()[0]
-                print(f" count: {count}, title: {title}")  # delete
-                print(f"listings Table trying to add: {title}")
-                if count == 0:
-                    # Insert into listings table if the item does not exist
-                    cursor.execute(
-                        """
-                    INSERT INTO listings (timed_classId_listings, title, assetId)
-                    VALUES (?, ?, ?)
-                    """,
-                        (timed_classId_listings, title, asset_id),
-                    )
-                    conn.commit()
-                    print(f"Item inserted: {title}")  # delete
-
-                # Transfer buy_price and prob_sell_price if classId matches
-                cursor.execute(
-                    """
-                SELECT buy_price, prob_sell_price FROM bought_items WHERE timed_classId = ?
+            # The first item of a classId wins, like the row by row sync did
+            cursor.execute(
+                """
+                INSERT INTO listings (timed_classId_listings, title, assetId)
+                SELECT t.timestamp || '_' || s.class_id, s.title, s.asset_id
+                FROM sync_timestamps t CROSS JOIN inventory_staging s
+                WHERE s.class_id IS NOT NULL
+                AND (? = 0 OR EXISTS (SELECT 1 FROM bought_items b WHERE b.timed_classId = t.timestamp || '_' || s.class_id))
+                ORDER BY s.position
+                ON CONFLICT(timed_classId_listings) DO NOTHING
                 """,
-                    (timed_classId_listings,),
+                (int(purchases_only),),
+            )
+            inserted = cursor.rowcount
+
+            # Transfer buy_price and prob_sell_price in dollars if the timed classId matches a purchase
+            cursor.execute(
+                """
+                UPDATE listings
+                SET buy_price = ROUND(b.buy_price / 100.0, 2), sell_price = ROUND(b.prob_sell_price / 100.0, 2)
+                FROM bought_items b
+                WHERE b.timed_classId = listings.timed_classId_listings
+                AND listings.timed_classId_listings IN (
+                    SELECT t.timestamp || '_' || s.class_id FROM sync_timestamps t CROSS JOIN inventory_staging s
                 )
-                result = cursor.fetchone()
-
-                if result:
-                    buy_price, prob_sell_price = result
-                    buy_price = round(buy_price / 100, 2)
-                    prob_sell_price = round(prob_sell_price / 100, 2)
-                    cursor.execute(
-                        """
-                    UPDATE listings
-                    SET buy_price = ?, sell_price = ?
-                    WHERE timed_classId_listings = ?
-                    """,
-                        (buy_price, prob_sell_price, timed_classId_listings),
-                    )
-                    conn.commit()
-                    print(f"Item parameters transfered: {title}")  # delete
-
-        # Check if the total number of items is less than or equal to 100
-        if int(data["Total"]) <= 100:
-            print("no loop needed")
-            break
+                """
+            )
+            updated = cursor.rowcount
+            cursor.execute("COMMIT")
+        except sqlite3.Error:
+            cursor.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    print(f"Inventory sync: {len(items)} items, {inserted} listings added, {updated} prices transferred")
+
+
+def get_inventory(timestamp_to_set):
+    items = fetch_inventory_items()
+    if items:
+        reconcile_inventory(items, [timestamp_to_set])
+    return items
+
 
-        # Increment the offset for the next request
-        offset += 100
-        print("loop needed")
+def purchase_time(timestamp: str) -> datetime:
+    """bought_items.timestamp is "%S-%M-%H-%d_%m-%Y" (config.timestamp), not sortable in SQL. Unknown formats count as old."""
+    try:
+        return datetime.strptime(timestamp, "%S-%M-%H-%d_%m-%Y")
+    except (TypeError, ValueError):
+        return datetime.min
 
-        params["offset"] = offset
+
+def sync_pending_inventory():
+    """Runs the inventory sync for purchases that have no listings row yet, e.g. because the sync failed after the buy."""
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT DISTINCT b.timestamp FROM bought_items b
+            LEFT JOIN listings l ON l.timed_classId_listings = b.timed_classId
+            WHERE b.status = 'bought' AND l.timed_classId_listings IS NULL
+            """
+        )
+        timestamps = [row[0] for row in cursor.fetchall()]
+    oldest = datetime.now() - timedelta(hours=pending_inventory_max_age_in_h)
+    timestamps = [ts for ts in timestamps if purchase_time(ts) >= oldest]
+    if not timestamps:
+        return
+    # One inventory fetch for all pending purchases, only the items of those purchases are added
+    items = fetch_inventory_items()
+    if items:
+        reconcile_inventory(items, timestamps, purchases_only=True)
 
 
 def get_fee():
@@ -431,9 +647,12 @@ def get_fee():
     url_path = "/exchange/v1/customized-fees"
     headers = generate_headers(method, url_path, params)
     url = API_URL_TRADING + url_path
-    response = requests.get(url, params=params, headers=headers)
-    
-    
+    try:
+        response = governed_get(url, params=params, headers=headers)
+    except requests.exceptions.RequestException as e:
+        print(f"Error: Request for fees failed: {e}")
+        return
+
     if response.status_code != 200:
         print(f"Error: Received status code {response.status_code}")
         return
@@ -490,6 +709,9 @@ def get_fee():
     conn.commit()
     conn.close()
 
+    # Keep the in-memory fees of this process in sync with the table
+    fee_cache.load()
+
 
 def create_target(body: CreateTargets):
     method = "POST"
@@ -507,10 +729,51 @@ def get_user_offers():
     method = "GET"
     headers = generate_headers(method, url_path, params)
     url = API_URL_TRADING + url_path
-    response = requests.get(url, params=params, headers=headers)
-    
+    try:
+        response = governed_get(url, params=params, headers=headers)
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to get user offers: {e}")
+        return None
+
+    if response.status_code != 200:
+        print(f"Failed to get user offers: {response.status_code}")
+        return None
+    return response.json()
+
+
+sell_batch_size = 100  # Offers per user-offers/create request
+sell_max_attempts = 3  # Failed offers of a batch are submitted again up to this many times
+
+
+def build_sell_body_from_offers(offers) -> dict:
+    """offers is an iterable of (AssetID, price) tuples."""
+    return {
+        "Offers": [{"AssetID": AssetID, "Price": {"Currency": "USD", "Amount": price}} for AssetID, price in offers]
+    }
+
+
+def create_offers(offers) -> tuple:
+    """Lists (AssetID, price) tuples in chunks of sell_batch_size. Returns AssetID: OfferID of the successful ones
+    and the set of AssetIDs the api rejected, assets of failed requests are in neither."""
+    url_path = "/marketplace-api/v1/user-offers/create"
+    method = "POST"
+    url = API_URL_TRADING + url_path
+    created = {}
+    rejected = set()
+    for start in range(0, len(offers), sell_batch_size):
+        body = build_sell_body_from_offers(offers[start:start + sell_batch_size])
+        headers = generate_headers(method, url_path, body=body)
+        response = api_call(url, method, headers, body=body)
+        if not response or "Result" not in response:
+            print(f"Listing batch of {len(body['Offers'])} offers failed: {response}")
+            continue
+        for result in response["Result"]:
+            if result.get("Successful"):
+                created[result["CreateOffer"]["AssetID"]] = result.get("OfferID")
+            else:
+                rejected.add(result["CreateOffer"]["AssetID"])
+    return created, rejected
 
-    
 
 def sell_item():
     with sqlite3.connect(db_path) as conn:
@@ -520,48 +783,54 @@ def sell_item():
         )
         listings = cursor.fetchall()
 
-    url_path = "/marketplace-api/v1/user-offers/create"
-    method = "POST"
-    for listing in listings:
-        timed_classId, assetId, sell_price = listing
-        # Skip if sell_price is NULL and update status to 'listing_error'
-        if sell_price is None:
-            cursor.execute(
-                "UPDATE listings SET status = ? WHERE timed_classId_listings = ?",
-                ("listing_error", timed_classId),
-            )
-            conn.commit()
-            print("fehler kein preis")
-            continue
-
-        body = build_sell_body_from_offer(assetId, sell_price)
-        headers = generate_headers(method, url_path, body=body)
-        url = API_URL_TRADING + url_path
-        response = api_call(url, method, headers, body=body)
-        print(response)
-
-        if response["Result"][0]["Successful"]:
-            print("erfolgreich")
-            cursor.execute(
-                "UPDATE listings SET status = ? WHERE timed_classId_listings = ?",
-                ("listed", timed_classId),
-            )
-            cursor.execute(
-                "UPDATE bought_items SET status = ? WHERE timed_classId = ?",
-                ("listed", timed_classId),
-            )
-            conn.commit()
+    # Listings without sell_price or assetId and further rows of an asset that is already listed here are set to 'listing_error'
+    errors = []
+    pending = {}  # timed_classId: (assetId, sell_price)
+    asset_rows = {}  # assetId: timed_classId, the api reports results per asset
+    for timed_classId, assetId, sell_price in listings:
+        if sell_price is None or assetId is None or assetId in asset_rows:
+            errors.append(timed_classId)
         else:
-            print("fehlgeschlagen")
-            cursor.execute(
-                "UPDATE listings SET status = ? WHERE timed_classId_listings = ?",
-                ("listing_error", timed_classId),
-            )
-            cursor.execute(
-                "UPDATE bought_items status = ? WHERE timed_classId = ?",
-                ("listing_error", timed_classId),
-            )
-            conn.commit()
+            pending[timed_classId] = (assetId, sell_price)
+            asset_rows[assetId] = timed_classId
+
+    listed = []
+    for attempt in range(sell_max_attempts):
+        if not pending:
+            break
+        created, rejected = create_offers(list(pending.values()))
+        for assetId, offerId in created.items():
+            if asset_rows.get(assetId) in pending:
+                timed_classId = asset_rows[assetId]
+                del pending[timed_classId]
+                listed.append((offerId, timed_classId))
+        for assetId in rejected:
+            if asset_rows.get(assetId) in pending:
+                timed_classId = asset_rows[assetId]
+                del pending[timed_classId]
+                errors.append(timed_classId)
+        if pending:
+            print(f"Attempt {attempt + 1}: {len(pending)} offers not listed")
+    # Assets of failed requests stay 'in_inventory' and are tried again in the next run
+
+    # All status changes in one transaction
+    with sqlite3.connect(db_path) as conn:
+        enable_wal(conn)
+        cursor = conn.cursor()
+        cursor.executemany(
+            "UPDATE listings SET status = 'listed', offerId = ? WHERE timed_classId_listings = ?", listed
+        )
+        cursor.executemany(
+            "UPDATE bought_items SET status = 'listed' WHERE timed_classId = ?", [(timed_classId,) for offerId, timed_classId in listed]
+        )
+        cursor.executemany(
+            "UPDATE listings SET status = 'listing_error' WHERE timed_classId_listings = ?", [(timed_classId,) for timed_classId in errors]
+        )
+        cursor.executemany(
+            "UPDATE bought_items SET status = 'listing_error' WHERE timed_classId = ?", [(timed_classId,) for timed_classId in errors]
+        )
+        conn.commit()
+    print(f"Listed {len(listed)} offers, {len(errors)} listing errors, {len(pending)} left for the next run")
 
 
 # def alter_listing()
@@ -573,119 +842,134 @@ def sell_item():
 
 
 def get_discount_fraction(offer_title):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT fraction FROM reduced_fees WHERE title = ?", (offer_title,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else 0.10  # Return 1.0 if no discount found
+    return fee_cache.get(offer_title)  # Returns 0.10 if no discount found or it expired
+
+
+def get_discount_fractions(offer_titles) -> dict:
+    return fee_cache.get_many(offer_titles)
 
 
 def markdown_items():
-    one_week_ago = datetime.now() - timedelta(weeks=1)
+    return reprice_items()
 
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
 
-        # Fetch items from bought_items table older than 1 week
-        cursor.execute(
-            """
-            SELECT timed_classId, title, buy_price FROM bought_items WHERE timestamp < ?
+def load_reprice_candidates(cursor, older_than: str):
+    """Listings of purchases older than older_than with the competing offers below their sell price, in one query."""
+    cursor.execute(
+        """
+        SELECT b.timed_classId, b.title, b.buy_price, l.sell_price, l.status, l.assetId, l.offerId,
+            (SELECT COALESCE(SUM(o.amount), 0) FROM title_offers o WHERE o.title = b.title AND o.price < l.sell_price * 100)
+        FROM bought_items b
+        JOIN listings l ON l.timed_classId_listings = b.timed_classId
+        WHERE b.timestamp < ? AND l.sell_price IS NOT NULL
         """,
-            (one_week_ago.strftime("%Y-%m-%d %H:%M:%S"),),
-        )
-        old_items = cursor.fetchall()
-        print(f"old items: {old_items}")  # delete
+        (older_than,),
+    )
+    return cursor.fetchall()
 
-        for timed_classId, title, buy_price in old_items:
-            # Fetch the current sell price from listings table
-            cursor.execute(
-                """
-                SELECT sell_price FROM listings WHERE timed_classId_listings = ?
-            """,
-                (timed_classId,),
-            )
-            result = cursor.fetchone()
-            if result is None:
-                continue
-            print(f"result {result}")
-            sell_price = result[0]
-            sell_price = sell_price * 100
-            print(f" sell price {sell_price}")
 
-            # Fetch and parse the offers_of_title field from the sales table
-            cursor.execute(
-                """
-                SELECT offers_of_title FROM sales WHERE title = ?
-            """,
-                (title,),
-            )
-            sales_items = cursor.fetchone()
-            if sales_items is None:
+def compute_markdown(sell_price: float, buy_price: float, fee: float):
+    """Adjusts the price down by 5% but not below a profit margin of 15%. Prices in cents, returns (new_sell_price, prob_profit)."""
+    new_sell_price = max(sell_price * 0.95, buy_price * 1.15)
+    prob_profit = (float(new_sell_price) - fee * float(new_sell_price)) - float(buy_price)
+    profit_margin = (prob_profit * 100) / buy_price
+    if profit_margin < 15:
+        new_sell_price = buy_price * 1.15
+        prob_profit = (float(new_sell_price) - fee * float(new_sell_price)) - float(buy_price)
+    return new_sell_price, prob_profit
+
+
+def edit_offers(offers) -> dict:
+    """Changes the price of listed offers, offers are (OfferID, AssetID, price) tuples.
+    Returns AssetID: NewOfferID of the successful edits."""
+    url_path = "/marketplace-api/v1/user-offers/edit"
+    method = "POST"
+    url = API_URL_TRADING + url_path
+    edited = {}
+    for start in range(0, len(offers), sell_batch_size):
+        body = {
+            "Offers": [
+                {"OfferID": OfferID, "AssetID": AssetID, "Price": {"Currency": "USD", "Amount": price}}
+                for OfferID, AssetID, price in offers[start:start + sell_batch_size]
+            ]
+        }
+        headers = generate_headers(method, url_path, body=body)
+        response = api_call(url, method, headers, body=body)
+        if not response or "Result" not in response:
+            print(f"Edit batch of {len(body['Offers'])} offers failed: {response}")
+            continue
+        for result in response["Result"]:
+            if result.get("Successful"):
+                edited[result["EditOffer"]["AssetID"]] = result.get("NewOfferID")
+    return edited
+
+
+def reprice_items(dry_run: bool = False) -> list:
+    """Marks down week old items with at least 4 cheaper offers. Listed offers are edited on the marketplace,
+    items still in the inventory only get the new price locally and are listed with it by sell_item.
+    Returns the price changes, with dry_run nothing is sent or written."""
+    one_week_ago = datetime.now() - timedelta(weeks=1)
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        candidates = load_reprice_candidates(cursor, one_week_ago.strftime("%Y-%m-%d %H:%M:%S"))
+    fees = get_discount_fractions({row[1] for row in candidates})
+
+    changes = []
+    for timed_classId, title, buy_price, sell_price, status, assetId, offerId, count_below in candidates:
+        if count_below < 4:
+            continue
+        new_sell_price, prob_profit = compute_markdown(sell_price * 100, buy_price, fees[title])
+        new_sell_price_listings = round(new_sell_price / 100, 2)
+        if new_sell_price_listings == sell_price:
+            continue  # Already at the lowest price
+        changes.append({
+            "timed_classId": timed_classId,
+            "title": title,
+            "status": status,
+            "assetId": assetId,
+            "offerId": offerId,
+            "old_sell_price": sell_price,
+            "new_sell_price": new_sell_price_listings,
+            "prob_sell_price": new_sell_price,
+            "prob_profit": prob_profit,
+        })
+
+    print(f"Repricing {len(changes)} of {len(candidates)} old items")
+    if dry_run or not changes:
+        for change in changes:
+            print(f"{change['title']}: {change['old_sell_price']} -> {change['new_sell_price']} ({change['status']})")
+        return changes
+
+    # Listed offers are edited in batches, only successful edits are written locally
+    for change in changes:
+        change["on_market"] = change["status"] == "listed" and bool(change["offerId"]) and bool(change["assetId"])
+    listed = [change for change in changes if change["on_market"]]
+    edited = edit_offers([(change["offerId"], change["assetId"], change["new_sell_price"]) for change in listed])
+    applied = []
+    for change in changes:
+        if change["on_market"]:
+            if change["assetId"] not in edited:
                 continue
-            offers_of_title = sales_items[0].split(", ")
-            print(f"offers_of_title: {offers_of_title}")  # Debugging
+            change["offerId"] = edited[change["assetId"]] or change["offerId"]
+        elif change["status"] != "in_inventory":
+            continue  # e.g. listing_error, gets the new price once it is listed again
+        applied.append(change)
 
-            # Count the number of offers below the current item's sell price
-            count_below = sum(
-                1 for price in offers_of_title if float(price) < sell_price
-            )
-            print(f"count below: {count_below}")  # Debugging
-
-            if count_below >= 4:
-                # Calculate profit margin
-
-                new_sell_price = max(sell_price * 0.95, buy_price * 1.15)
-                new_sell_price_listings = round(new_sell_price / 100, 2)
-
-                fee = get_discount_fraction(title)
-                prob_profit = (
-                    float(new_sell_price) - fee * float(new_sell_price)
-                ) - float(buy_price)
-
-                profit_margin = (prob_profit * 100) / buy_price
-                print(f" profit margin: {profit_margin}")  # delete
-
-                if profit_margin < 15:
-                    profit_margin = 15
-                    new_sell_price = buy_price * 1.15
-                    new_sell_price_listings = round(new_sell_price / 100, 2)
-                    prob_profit = (
-                        float(new_sell_price) - fee * float(new_sell_price)
-                    ) - float(buy_price)
-                    print(
-                        f"profit margin of {title} is now {profit_margin}%, the new sell price is: {new_sell_price}, the new prob profit is {prob_profit}"
-                    )
-
-                if profit_margin >= 15:
-                    # Adjust price down by 5% profit but do not go below a profit margin of 15%
-
-                    # Update the sell price in listings table
-                    cursor.execute(
-                        """
-                        UPDATE listings SET sell_price = ? WHERE timed_classId_listings = ?
-                    """,
-                        (new_sell_price_listings, timed_classId),
-                    )
-                    conn.commit()
-
-                    # Update prob_sell_price and prob_profit in bought_items table
-                    cursor.execute(
-                        """
-                        UPDATE bought_items SET prob_sell_price = ?, prob_profit = ?, timestamp = ? WHERE timed_classId = ?
-                        """,
-                        (new_sell_price, prob_profit, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), timed_classId),
-                    )
-
-                    conn.commit()
-
-                    print(
-                        f"Updated sell price for {title} to {new_sell_price_listings}"
-                    )
-                    print(
-                        f"Updated prob_sell_price to {new_sell_price} and prob_profit to {prob_profit}"
-                    )
-    
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with sqlite3.connect(db_path) as conn:
+        enable_wal(conn)
+        cursor = conn.cursor()
+        cursor.executemany(
+            "UPDATE listings SET sell_price = ?, offerId = ? WHERE timed_classId_listings = ?",
+            [(change["new_sell_price"], change["offerId"], change["timed_classId"]) for change in applied],
+        )
+        cursor.executemany(
+            "UPDATE bought_items SET prob_sell_price = ?, prob_profit = ?, timestamp = ? WHERE timed_classId = ?",
+            [(change["prob_sell_price"], change["prob_profit"], now, change["timed_classId"]) for change in applied],
+        )
+        conn.commit()
+    print(f"Repriced {len(applied)} items, {len(listed) - len(edited)} edits failed")
+    return applied
 
 
 def build_buy_body_from_offer(offer_id: str, price: float):
@@ -756,6 +1040,7 @@ def format_offer(
 def get_combined_sales(
     title: str, limit: str, start_date: datetime = None
 ) -> LastSales:
+    from schemas import LastSales
     sales1 = last_sales("a8db", title, limit, "0", start_date)
     sales2 = last_sales("a8db", title, limit, "500", start_date)
 
@@ -768,6 +1053,7 @@ def filter_outliers(sales: List[LastSale]) -> List[LastSale]:
     if not sales:
         return []
 
+    import numpy as np
     prices = [float(sale.price) for sale in sales]
     q1 = np.percentile(prices, 25)
     q3 = np.percentile(prices, 75)
@@ -825,6 +1111,11 @@ def delte_listing_errors():
 #               #
 
 
+def enable_wal_mode():
+    with sqlite3.connect(db_path) as conn:
+        enable_wal(conn)
+
+
 def create_sales_table():
     with sqlite3.connect(db_path) as conn:
         cursor = conn.cursor()
@@ -839,13 +1130,33 @@ def create_sales_table():
             avg_all_time REAL NOT NULL,
             sales_month INTEGER NOT NULL,
             avg_last_20_sales TEXT NOT NULL,
-            offers_of_title INTEGER DEFAULT 0
+            offers_of_title INTEGER DEFAULT 0,
+            price_volatility REAL DEFAULT 0
         )
         """
         )
+        # Columns added after the table was first created, market prices in cents
+        add_missing_columns(cursor, "sales", {
+            "price_volatility": "REAL DEFAULT 0",
+            "best_ask": "REAL DEFAULT NULL",
+            "ask_count": "INTEGER DEFAULT 0",
+            "best_bid": "REAL DEFAULT NULL",
+            "bid_count": "INTEGER DEFAULT 0",
+            "market_moved": "INTEGER DEFAULT 0",  # Set by the bulk market price refresh, cleared by the per title refresh
+            "refresh_fingerprint": "TEXT DEFAULT NULL",  # Newest sale, ask count and best ask at the last full refresh
+            "last_full_refresh": "TEXT DEFAULT NULL",
+        })
         conn.commit()
 
 
+def add_missing_columns(cursor, table: str, columns: dict):
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for column, definition in columns.items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
 def create_bought_items_table():
     with sqlite3.connect(db_path) as conn:
         cursor = conn.cursor()
@@ -880,6 +1191,8 @@ def create_listings_table():
         )
         """
         )
+        # OfferID of the marketplace offer, needed to edit or delete the listing later
+        add_missing_columns(cursor, "listings", {"offerId": "TEXT DEFAULT NULL"})
         conn.commit()
 
 
@@ -897,3 +1210,190 @@ def create_reduced_fees_table():
     )
     conn.commit()
     conn.close()
+
+
+# Competing offer prices per title, one row per price level. Replaces the comma separated sales.offers_of_title column
+def create_title_offers_table():
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+        CREATE TABLE IF NOT EXISTS title_offers (
+            title TEXT NOT NULL,
+            price REAL NOT NULL,
+            amount INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (title, price)
+        ) WITHOUT ROWID
+        """
+        )
+        conn.commit()
+
+
+# Bid ladder of the cumulative price levels, same layout as title_offers
+def create_title_targets_table():
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+        CREATE TABLE IF NOT EXISTS title_targets (
+            title TEXT NOT NULL,
+            price REAL NOT NULL,
+            amount INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (title, price)
+        ) WITHOUT ROWID
+        """
+        )
+        conn.commit()
+
+
+def migrate_offers_of_title():
+    """Moves the comma separated offers_of_title strings into title_offers and clears the old column."""
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT title, offers_of_title FROM sales WHERE offers_of_title IS NOT NULL")
+        rows = cursor.fetchall()
+        for title, offers_of_title in rows:
+            if isinstance(offers_of_title, str):
+                prices = [float(price) for price in offers_of_title.split(", ") if price.strip()]
+            else:
+                # A single offer was stored as a number by the INTEGER column, 0 is the column default
+                prices = [float(offers_of_title)] if offers_of_title > 0 else []
+            if prices:
+                replace_title_offers(cursor, title, prices)
+        # Only the rows read above are cleared, every one of them was migrated or held no offers
+        cursor.executemany("UPDATE sales SET offers_of_title = NULL WHERE title = ?", [(title,) for title, offers_of_title in rows])
+        conn.commit()
+        if rows:
+            conn.execute("VACUUM")  # Give the space of the old strings back
+    if rows:
+        print(f"Migrated offers of {len(rows)} titles to title_offers")
+
+
+def title_offers_ops(title: str, prices: List[float]) -> list:
+    """Statements replacing all offers of one title, as (sql, params) for the DBWriter."""
+    amounts = {}
+    for price in prices:
+        amounts[price] = amounts.get(price, 0) + 1
+    return ladder_ops("title_offers", title, amounts.items())
+
+
+def ladder_ops(table: str, title: str, ladder) -> list:
+    ops = [(f"DELETE FROM {table} WHERE title = ?", (title,))]
+    ops.extend(
+        (f"INSERT INTO {table} (title, price, amount) VALUES (?, ?, ?)", (title, price, amount))
+        for price, amount in ladder
+    )
+    return ops
+
+
+def order_book_ops(title: str, asks: List[tuple], bids: List[tuple]) -> list:
+    """Statements replacing the ask ladder in title_offers and the bid ladder in title_targets."""
+    return ladder_ops("title_offers", title, asks) + ladder_ops("title_targets", title, bids)
+
+
+def replace_title_offers(cursor, title: str, prices: List[float]):
+    """Replaces all offers of one title, the caller commits."""
+    for sql, params in title_offers_ops(title, prices):
+        cursor.execute(sql, params)
+
+
+def count_offers_below(cursor, title: str, price: float) -> int:
+    cursor.execute(
+        "SELECT COALESCE(SUM(amount), 0) FROM title_offers WHERE title = ? AND price < ?",
+        (title, price),
+    )
+    return cursor.fetchone()[0]
+
+
+def best_bid(cursor, title: str):
+    """Highest target price in cents, None without targets."""
+    cursor.execute("SELECT MAX(price) FROM title_targets WHERE title = ?", (title,))
+    return cursor.fetchone()[0]
+
+
+def get_title_offer_prices(cursor, title: str) -> List[float]:
+    cursor.execute("SELECT price, amount FROM title_offers WHERE title = ? ORDER BY price", (title,))
+    return [price for price, amount in cursor.fetchall() for _ in range(amount)]
+
+
+# Single sales per title, prices in cents. Grows with every refresh, beyond the 500 sales the api returns
+def create_sales_history_table():
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+        CREATE TABLE IF NOT EXISTS sales_history (
+            title TEXT NOT NULL,
+            date INTEGER NOT NULL,
+            price REAL NOT NULL,
+            PRIMARY KEY (title, date, price)
+        ) WITHOUT ROWID
+        """
+        )
+        # Sales with the same second and price share one row
+        add_missing_columns(cursor, "sales_history", {"amount": "INTEGER NOT NULL DEFAULT 1"})
+        conn.commit()
+
+
+def sales_history_ops(title: str, sales: List[tuple]) -> list:
+    """Statements storing (timestamp, price) sales of one title. A refetched second keeps the higher amount,
+    so the sales at the stored boundary are not counted twice."""
+    return [
+        (
+            "INSERT INTO sales_history (title, date, price, amount) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(title, date, price) DO UPDATE SET amount = MAX(amount, excluded.amount)",
+            (title, date, price, amount),
+        )
+        for (date, price), amount in Counter(sales).items()
+    ]
+
+
+def load_sales_history(cursor, title: str) -> List[tuple]:
+    cursor.execute("SELECT date, price, amount FROM sales_history WHERE title = ?", (title,))
+    return cursor.fetchall()
+
+
+def load_latest_sale_dates(cursor) -> dict:
+    cursor.execute("SELECT title, MAX(date) FROM sales_history GROUP BY title")
+    return dict(cursor.fetchall())
+
+
+# Offers per title seen by the sniping loop, used to refresh the titles that actually show up first
+def create_title_hits_table():
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+        CREATE TABLE IF NOT EXISTS title_hits (
+            title TEXT PRIMARY KEY,
+            hits REAL NOT NULL DEFAULT 0,
+            last_hit TEXT NOT NULL
+        )
+        """
+        )
+        conn.commit()
+
+
+def record_title_hits(hits: dict):
+    """Adds the hits counted since the last call to the stored count, which is decayed to now first.
+    The refresh scheduler decays the result further by the age of last_hit."""
+    if not hits:
+        return
+    now = time.time()
+    now_str = datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+    titles = list(hits)
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        stored = {}
+        for start in range(0, len(titles), 500):  # Stays below the variable limit of older SQLite versions
+            chunk = titles[start:start + 500]
+            cursor.execute(f"SELECT title, hits, last_hit FROM title_hits WHERE title IN ({', '.join('?' * len(chunk))})", chunk)
+            stored.update({title: (count, last_hit) for title, count, last_hit in cursor.fetchall()})
+        cursor.executemany(
+            """
+            INSERT INTO title_hits (title, hits, last_hit) VALUES (?, ?, ?)
+            ON CONFLICT(title) DO UPDATE SET hits = excluded.hits, last_hit = excluded.last_hit
+            """,
+            [(title, decayed_hits(*stored.get(title, (0, None)), now) + count, now_str) for title, count in hits.items()],
+        )
+        conn.commit()
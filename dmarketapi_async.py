@@ -0,0 +1,272 @@
+# Annotations stay strings, so the pydantic schemas are only imported by the function that uses them
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timezone
+import logging
+from typing import List
+
+import aiohttp
+from yarl import URL
+
+from config import API_URL, API_URL_TRADING, http_pool_size, request_timeouts
+import numpy as np
+
+from signing import encode_body, canonical_path
+from dmarketapi import generate_headers, get_timeout, build_buy_body_from_offer, parse_last_sales_columns, parse_order_book
+from ratelimit import rate_limiter, PRIORITY_HIGH, PRIORITY_LOW
+
+
+logger = logging.getLogger(__name__)
+
+# Shared aiohttp session, bound to the event loop that created it
+_session = None
+
+
+async def get_async_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=http_pool_size * 10,  # Connections kept alive in total
+            limit_per_host=http_pool_size * 10,
+            keepalive_timeout=60,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=request_timeouts["GET"]),
+        )
+    return _session
+
+
+async def close_async_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def api_call_async(
+    url: str,
+    method: str,
+    headers: dict,
+    params: dict = None,
+    body: dict = None,
+    max_retries: int = 20,
+    priority: int = PRIORITY_LOW,
+) -> dict:
+    session = await get_async_session()
+    timeout = aiohttp.ClientTimeout(total=get_timeout(url, method))
+    backoff_time = 1  # Initial backoff time in seconds
+    data = None
+    if body is not None:
+        data = encode_body(body)  # The signed bytes
+        headers = {**headers, "Content-Type": "application/json"}
+    # The query is encoded like the signed one, yarl would leave ( ) and ' unescaped and break the signature
+    request_url = URL(canonical_path(url, params), encoded=True)
+
+    for attempt in range(max_retries):
+        # Share the budget with the threaded client, without blocking the event loop
+        wait = rate_limiter.reserve(url, priority)
+        while wait > 0:
+            await asyncio.sleep(min(wait, 1.0))
+            wait = rate_limiter.reserve(url, priority)
+        try:
+            async with session.request(
+                method, request_url, data=data, headers=headers, timeout=timeout
+            ) as response:
+                rate_limiter.update_from_headers(url, response.headers)
+                if response.status in (403, 429):
+                    rate_limiter.penalize(url, response.headers)
+                    continue  # The rate limiter decides when the next attempt may start
+                elif response.status in (500, 502, 503, 504):
+                    print(f"HTTP error: {response.status}, retrying")
+                elif 400 <= response.status < 500:
+                    print(f"Client error: {response.status} for url {url}")
+                    return None
+                else:
+                    text = await response.text()
+                    if not text:
+                        print("Empty response received")
+                        return None
+                    return await response.json(content_type=None)
+        except asyncio.TimeoutError:
+            print(f"Timeout error for url {url}")
+        except aiohttp.ClientError as e:
+            print(f"An error occurred: {e}")
+
+        await asyncio.sleep(backoff_time)
+        backoff_time = min(backoff_time * 2, 300)
+
+    print(f"Max retries reached for url {url}")
+    return None
+
+
+##############
+# Endpoints   #
+##############
+
+
+async def get_offer_from_market_async(min_item_price: int, max_item_price: int) -> List[dict]:
+    url_path = "/exchange/v1/market/items"
+    url = API_URL + url_path
+    params = {
+        "gameId": "a8db",
+        "limit": 5,
+        "offset": 0,
+        "orderBy": "updated",
+        "orderDir": "desc",
+        "treeFilters": "",
+        "currency": "USD",
+        "priceFrom": min_item_price,
+        "priceTo": max_item_price,
+        "cursor": "",
+    }
+    method = "GET"
+    headers = generate_headers(method, url_path, params)
+    response = await api_call_async(url, method, headers, params, priority=PRIORITY_HIGH)
+    if response is None:
+        return []
+    return response.get("objects", [])
+
+
+async def last_sales_async(
+    gameId: str,
+    title: str,
+    limit: str,
+    offset: str = "0",
+    start_date: datetime = None,
+    end_date: datetime = None,
+) -> LastSales:
+    """Async counterpart of dmarketapi.last_sales."""
+    from schemas import LastSales
+
+    method = "GET"
+    params = {"gameId": gameId, "title": title, "limit": limit, "offset": offset}
+    url_path = "/trade-aggregator/v1/last-sales"
+    headers = generate_headers(method, url_path, params)
+    url = API_URL_TRADING + url_path
+    response = await api_call_async(url, method, headers, params)
+    if not response or "sales" not in response:
+        print(f"Invalid response for title: {title}")
+        return LastSales(sales=[])
+
+    sales = LastSales(**response)
+
+    if start_date is not None:
+        start_date = start_date.replace(tzinfo=timezone.utc)
+        sales.sales = [sale for sale in sales.sales if sale.date >= start_date]
+
+    if end_date is not None:
+        end_date = end_date.replace(tzinfo=timezone.utc)
+        sales.sales = [sale for sale in sales.sales if sale.date <= end_date]
+
+    return sales
+
+
+async def last_sales_columns_async(
+    gameId: str, title: str, limit: str, offset: str = "0", validate: bool = False
+) -> tuple:
+    """Async counterpart of dmarketapi.last_sales_columns."""
+    method = "GET"
+    params = {"gameId": gameId, "title": title, "limit": limit, "offset": offset}
+    url_path = "/trade-aggregator/v1/last-sales"
+    headers = generate_headers(method, url_path, params)
+    url = API_URL_TRADING + url_path
+    response = await api_call_async(url, method, headers, params)
+    if not response or "sales" not in response:
+        print(f"Invalid response for title: {title}")
+        return None  # Failed, unlike the empty arrays of a title without sales
+    return parse_last_sales_columns(response, validate)
+
+
+async def offer_prices_by_title_async(title: str, limit: str) -> np.ndarray:
+    """Async counterpart of dmarketapi.offer_prices_by_title."""
+    method = "GET"
+    cursor = ""
+    prices = []
+
+    while True:
+        params = {"title": title, "limit": limit, "Cursor": cursor}
+        url_path = "/exchange/v1/offers-by-title"
+        headers = generate_headers(method, url_path, params)
+        url = API_URL_TRADING + url_path
+
+        response = await api_call_async(url, method, headers, params)
+        if response is None:
+            logger.error(f"Failed to get response for title: {title}")
+            break
+
+        prices.extend(offer["price"]["USD"] for offer in response.get("objects", []))
+
+        if response.get("cursor") and len(prices) >= 100:
+            cursor = response["cursor"]
+        else:
+            break
+
+    return np.array(prices, dtype=np.float64)
+
+
+async def order_book_by_title_async(title: str, game_id: str = "a8db"):
+    """Async counterpart of dmarketapi.order_book_by_title."""
+    method = "GET"
+    params = {"Title": title, "GameID": game_id}
+    url_path = "/marketplace-api/v1/cumulative-price-levels"
+    headers = generate_headers(method, url_path, params)
+    url = API_URL_TRADING + url_path
+
+    response = await api_call_async(url, method, headers, params)
+    if response is None:
+        logger.error(f"Failed to get order book for title: {title}")
+        return None
+    return parse_order_book(response)
+
+
+async def offers_by_title_async(title: str, limit: str) -> tuple:
+    method = "GET"
+    cursor = ""
+    all_offers = []
+
+    while True:
+        params = {"title": title, "limit": limit, "Cursor": cursor}
+        url_path = "/exchange/v1/offers-by-title"
+        headers = generate_headers(method, url_path, params)
+        url = API_URL_TRADING + url_path
+
+        response = await api_call_async(url, method, headers, params)
+        if response is None:
+            logger.error(f"Failed to get response for title: {title}")
+            break
+
+        all_offers.extend(response.get("objects", []))
+
+        if "cursor" in response and response["cursor"] and len(all_offers) >= 100:
+            cursor = response["cursor"]
+        else:
+            break
+
+    return all_offers, cursor
+
+
+async def buy_item_async(offer_id: str, price: float) -> dict:
+    method = "PATCH"
+    url_path = "/exchange/v1/offers-buy"
+    body = build_buy_body_from_offer(offer_id, price)
+    headers = generate_headers(method, url_path, body=body)
+    url = API_URL_TRADING + url_path
+    response = await api_call_async(url, method, headers, body=body, priority=PRIORITY_HIGH)
+    print(response)
+    if response is None:
+        return {"orderId": None, "status": None}
+    return {"orderId": response.get("orderId"), "status": response.get("status")}
+
+
+async def balance_async():
+    method = "GET"
+    url_path = "/account/v1/balance"
+    headers = generate_headers(method, url_path)
+    url = API_URL_TRADING + url_path
+    response = await api_call_async(url, method, headers, max_retries=1, priority=PRIORITY_HIGH)
+    if response is None:
+        print("Failed to get balance")
+        return None
+    return response.get("usd", 0)
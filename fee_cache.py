@@ -0,0 +1,72 @@
+import sqlite3
+import threading
+import time
+
+from config import db_path, fee_cache_refresh_in_s
+from helpers import PeriodicTask
+
+
+class FeeCache:
+    """Reduced fee fractions from the reduced_fees table, kept in memory and honoring expiresAt."""
+
+    def __init__(self, db_path: str, refresh_interval: float = 3600, default_fee: float = 0.10):
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self.default_fee = default_fee
+        self.fees = {}  # title: (fraction, expires_at in unix seconds)
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._sync_fees = None
+        self._refresher = PeriodicTask("fee-cache-refresh", self.refresh, refresh_interval)
+
+    def load(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT title, fraction, expiresAt FROM reduced_fees")
+            rows = cursor.fetchall()
+
+        fees = {}
+        for title, fraction, expires_at in rows:
+            expires_at = expires_at or 0
+            if expires_at > 1e12:  # Milliseconds
+                expires_at = expires_at / 1000
+            fees[title] = (float(fraction), expires_at)
+
+        # Swap the whole dict so readers never see a half loaded cache
+        self.fees = fees
+        self.loaded = True
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self.load()
+
+    def get(self, title: str, now: float = None) -> float:
+        self._ensure_loaded()
+        entry = self.fees.get(title)
+        if entry is None:
+            return self.default_fee
+        fraction, expires_at = entry
+        if expires_at and expires_at < (now or time.time()):
+            return self.default_fee  # The reduced fee ran out
+        return fraction
+
+    def get_many(self, titles) -> dict:
+        now = time.time()
+        return {title: self.get(title, now) for title in titles}
+
+    def refresh(self):
+        if self._sync_fees is not None:
+            self._sync_fees()  # Pulls the fees from the api into reduced_fees
+        self.load()
+
+    def start(self, sync_fees=None):
+        self._sync_fees = sync_fees
+        self._refresher.start()
+
+    def stop(self):
+        self._refresher.stop()
+
+
+fee_cache = FeeCache(db_path, fee_cache_refresh_in_s)
@@ -0,0 +1,38 @@
+import json
+import os
+import threading
+
+
+class PeriodicTask:
+    """Calls target every interval seconds in a daemon thread until stop(). A failed run is printed, the next one still runs."""
+
+    def __init__(self, name: str, target, interval: float):
+        self.name = name
+        self.target = target
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _loop(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.target()
+            except Exception as e:
+                print(f"{self.name} failed: {e}")
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def write_json_atomic(path: str, data):
+    # Write to a temp file first so a crash never leaves a half written file behind, one temp file per thread
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
@@ -1,8 +1,9 @@
 from dmarketapi import get_inventory, create_listings_table, sell_item, delte_listing_errors
-from config import timestamp
-#create_listings_table()
-get_inventory("2024-08-31 10:06:41")
-#sell_item()
+
+if __name__ == "__main__":
+    #create_listings_table()
+    get_inventory("2024-08-31 10:06:41")
+    #sell_item()
 
 
 
@@ -1,15 +1,39 @@
 import sqlite3
+import asyncio
 import concurrent.futures
 import signal
 import threading
-from datetime import datetime, timedelta, timezone
-from dmarketapi import last_sales, filter_outliers, offers_by_title, create_sales_table
+from datetime import datetime, timedelta
+from dmarketapi import aggregated_prices, market_prices_ops, last_sales_columns, offer_prices_by_title, order_book_by_title, create_sales_table, create_title_offers_table, create_title_targets_table, migrate_offers_of_title, title_offers_ops, order_book_ops, enable_wal_mode, create_sales_history_table, create_title_hits_table, sales_history_ops, load_sales_history, load_latest_sale_dates
+from db_writer import DBWriter, enable_wal
+from refresh_scheduler import RefreshScheduler
+from sales_stats import compute_sales_stats, history_to_arrays, merge_sales_arrays
+import numpy as np
+from dmarketapi_async import last_sales_columns_async, offer_prices_by_title_async, order_book_by_title_async, close_async_session
 from config import no_data_titles_path, db_path
+from ratelimit import rate_limiter
 import time
 import logging
 
 # Configuration
 refresh_time_in_h = 0.5
+use_async_refresh = True #refresh with asyncio instead of the thread pool
+max_titles_in_flight = 200 #titles refreshed concurrently in async mode
+write_batch_rows = 500 #statements collected before the writer commits
+write_flush_interval_ms = 250 #max time a statement waits in the writer before it is committed
+sales_page_size = 50 #last sales fetched per request when the title already has stored sales
+max_sales_window = 500 #sales the api returns at most for one title
+validate_sales = False #parse last sales through the pydantic models in schemas.py instead of the fast path
+use_order_book = True #one cumulative price levels call per title for asks and bids instead of paging offers-by-title
+use_scheduler = False #refresh continuously in priority order instead of all stale titles once
+scheduler_batch_size = 200 #titles refreshed per scheduler round
+min_refresh_interval_in_h = 0.1 #the scheduler skips titles refreshed more recently than this
+use_market_prices = True #bulk aggregated prices decide which stale titles get the expensive per title refresh
+price_move_threshold = 0.03 #relative change of the best ask or best bid that counts as a move
+max_unmoved_age_in_h = 24 #titles without a move are still refreshed after this time
+use_fingerprints = True #skip the recompute of titles whose newest sale, offer count and best ask did not change, needs use_market_prices
+max_skip_age_in_h = 24 #titles are fully recomputed at least this often, so the week and month windows move on
+unmoved_probe_interval_in_h = 6 #with fingerprints, titles without a market move are probed this often instead of waiting max_unmoved_age_in_h
 bad_words = ['key', 'pin', 'sticker', 'case', 'operation', 'pass', 'capsule', 'package', 'challengers', 'patch', 'music', 'kit', 'graffiti', 'contenders']
 
 # Setup logging
@@ -22,128 +46,416 @@ def signal_handler(sig, frame):
     logger.info('You pressed Ctrl+C!')
     stop_event.set()
 
-signal.signal(signal.SIGINT, signal_handler)
-
 # Shared counter and lock
 total_updated_items = 0
+total_skipped_items = 0
 counter_lock = threading.Lock()
 
-create_sales_table()
-
-def update_item(title_tuple):
-    global total_updated_items
-    if stop_event.is_set():
-        return 0  # Exit if stop_event is set
-    title, last_update, avg_min, avg_week, avg_month, avg_all_time, sales_month, avg_last_20_sales, offers_of_title = title_tuple
-
+# All refresh writes go through one connection, created per run in start_sales_writer
+sales_writer = None
+read_local = threading.local()
+latest_sale_dates = {}  # title: timestamp of the newest stored sale, loaded per run
+title_fingerprints = {}  # title: (fingerprint, time) of the last full refresh
+title_markets = {}  # title: (best_ask, ask_count) from the bulk market prices
+EMPTY_SALES = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+
+def startup():
+    enable_wal_mode()
+    create_sales_table()
+    create_title_offers_table()
+    create_title_targets_table()
+    create_sales_history_table()
+    create_title_hits_table()
+    migrate_offers_of_title()
+
+def skip_title(title):
     if not title.strip():  
         logger.info(f"Skipping blank title")
-        return 0
+        return True
     
     if any(bad_word in title.lower() for bad_word in bad_words):
         logger.info(f"Skipping title with bad word: {title}")
-        return 0  # Skip titles with bad words
+        return True  # Skip titles with bad words
+    return False
 
-    try:
-        # Fetch all sales data in a single request
-        combined_sales_all_time = last_sales("a8db", title, 500, "0", datetime.min.replace(tzinfo=timezone.utc))
-        
 
-        # Filter sales data locally
-        one_week_ago = datetime.now(timezone.utc) - timedelta(weeks=1)
-        one_month_ago = datetime.now(timezone.utc) - timedelta(weeks=4)
+def collect_new_sales(page, latest_date, new_sales):
+    """Adds the sales of one page newer than the stored ones, returns True when paging can stop."""
+    timestamps, prices = page
+    is_new = timestamps >= latest_date
+    new_sales.append((timestamps[is_new], prices[is_new]))
+    return timestamps.size < sales_page_size or not is_new.all()
 
-        filtered_sales_week = [sale for sale in combined_sales_all_time.sales if sale.date >= one_week_ago]
-        filtered_sales_month = [sale for sale in combined_sales_all_time.sales if sale.date >= one_month_ago]
-        filtered_sales_all_time = combined_sales_all_time.sales
 
-        new_sales_month = len(filtered_sales_month)
+def concat_sales(pages):
+    if not pages:
+        return EMPTY_SALES
+    return np.concatenate([page[0] for page in pages]), np.concatenate([page[1] for page in pages])
 
-        # Convert prices from last_sales to cents
 
-        # Apply the filter_outliers function
-        filtered_sales_week = filter_outliers(filtered_sales_week)
-        filtered_sales_month = filter_outliers(filtered_sales_month)
-        filtered_sales_all_time = filter_outliers(filtered_sales_all_time)
+class SalesFetchError(Exception):
+    """A last-sales page failed. The refresh of the title is dropped, so no sales are written and its boundary stays."""
 
-        new_avg_week = round(sum(float(sale.price) * 100 for sale in filtered_sales_week) / len(filtered_sales_week), 2) if filtered_sales_week else 0
-        new_avg_month = round(sum(float(sale.price) * 100 for sale in filtered_sales_month) / len(filtered_sales_month), 2) if filtered_sales_month else 0
-        new_avg_all_time = round(sum(float(sale.price) * 100 for sale in filtered_sales_all_time) / len(filtered_sales_all_time), 2) if filtered_sales_all_time else 0
 
-        avg_values = [avg for avg in [new_avg_week, new_avg_month] if avg > 0]
-        new_avg_min = round(min(avg_values), 2) if avg_values else 0
+def sales_page(title, limit, offset="0"):
+    page = last_sales_columns("a8db", title, limit, offset, validate_sales)
+    if page is None:
+        raise SalesFetchError(f"last sales page at offset {offset} failed")
+    return page
 
-        
 
-        sorted_sales = sorted(filtered_sales_all_time, key=lambda sale: sale.date, reverse=True)
-        most_recent_20_sales = sorted_sales[:20]
+async def sales_page_async(title, limit, offset="0"):
+    page = await last_sales_columns_async("a8db", title, limit, offset, validate_sales)
+    if page is None:
+        raise SalesFetchError(f"last sales page at offset {offset} failed")
+    return page
+
 
-        if most_recent_20_sales:
-            new_avg_recent_20_sales = round(sum(float(sale.price) * 100 for sale in most_recent_20_sales) / len(most_recent_20_sales), 2)
+def fetch_new_sales(title, latest_date, first_page=None):
+    if latest_date is None:
+        # Nothing stored yet, take the whole api window at once
+        return sales_page(title, max_sales_window)
+
+    new_sales = []
+    for offset in range(0, max_sales_window, sales_page_size):
+        if offset == 0 and first_page is not None:
+            page = first_page  # Already fetched for the fingerprint
         else:
-            new_avg_recent_20_sales = 0
+            page = sales_page(title, sales_page_size, str(offset))
+        if collect_new_sales(page, latest_date, new_sales):
+            break
+    return concat_sales(new_sales)
 
-        new_avg_recent_20_sales_str = str(new_avg_recent_20_sales)
 
-        # Process offers data without caching
-        offers_by_title_list, cursor = offers_by_title(title, "100")
-        new_offers_prices = sorted([str(float(o['price']['USD'])) for o in offers_by_title_list]) #new_offers_prices = sorted([str(float(o['price']['USD']) / 100) for o in offers_by_title_list])
-        new_offers_of_title = ', '.join(new_offers_prices)
-        
-        # Convert the prices to float for sorting
-        sorted_offers = sorted([float(price) for price in new_offers_prices])
-        
-        # Convert back to string for saving to the database
-        sorted_offers_str = ', '.join([str(price) for price in sorted_offers])
-
-        with sqlite3.connect(db_path) as conn: 
-        #with sqlite3.connect('sales_data.db') as conn:
-        #with sqlite3.connect('/home/gira/Bot_and_DB/sales_data.db') as conn:  # Use the full path to your database file on pi
-            db_cursor = conn.cursor()
-            db_cursor.execute('''
-                UPDATE sales SET
-                    last_update = ?,
-                    avg_min = ?,
-                    avg_week = ?,
-                    avg_month = ?,
-                    avg_all_time = ?,
-                    sales_month = ?,
-                    avg_last_20_sales = ?,
-                    offers_of_title = ?
-                WHERE title = ?
-            ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), new_avg_min, new_avg_week, new_avg_month, new_avg_all_time, new_sales_month, new_avg_recent_20_sales_str, sorted_offers_str, title))
-            conn.commit()
-            #logger.info(f"Database updated for item: {title}") #bloats the output only for debugging
-        #logger.info(f"Updated item: {title}") #bloats the output only for debugging
+async def fetch_new_sales_async(title, latest_date, first_page=None):
+    if latest_date is None:
+        return await sales_page_async(title, max_sales_window)
+
+    new_sales = []
+    for offset in range(0, max_sales_window, sales_page_size):
+        if offset == 0 and first_page is not None:
+            page = first_page
+        else:
+            page = await sales_page_async(title, sales_page_size, str(offset))
+        if collect_new_sales(page, latest_date, new_sales):
+            break
+    return concat_sales(new_sales)
+
+
+def title_fingerprint(title, newest_sales):
+    """Newest sale timestamp of the api plus offer count and best ask of the bulk market prices."""
+    timestamps = newest_sales[0]
+    best_ask, ask_count = title_markets.get(title, (None, None))
+    # best_ask comes back from its REAL column as a float, normalized so stored and fresh fingerprints compare equal
+    best_ask = int(round(best_ask)) if best_ask is not None else None
+    ask_count = int(ask_count) if ask_count is not None else None
+    return f"{int(timestamps.max()) if timestamps.size else None}:{ask_count}:{best_ask}"
+
+
+def fingerprint_unchanged(title, fingerprint):
+    """Same newest sale and no market move since the last full refresh, with the threshold of title_moved."""
+    stored, refreshed_at = title_fingerprints.get(title, (None, None))
+    if stored is None or refreshed_at is None:
+        return False
+    if refreshed_at <= (datetime.now() - timedelta(hours=max_skip_age_in_h)).strftime('%Y-%m-%d %H:%M:%S'):
+        return False
+    newest, ask_count, best_ask = fingerprint.split(":")
+    old_newest, old_ask_count, old_best_ask = stored.split(":")
+    if newest != old_newest:
+        return False
+    if "None" in (ask_count, best_ask, old_ask_count, old_best_ask):
+        return (ask_count, best_ask) == (old_ask_count, old_best_ask)
+    # Small ask changes below price_move_threshold do not count, otherwise almost no fingerprint would stay the same
+    return not title_moved((float(old_best_ask), int(old_ask_count), None, 0), (float(best_ask), int(ask_count), 0, 0))
+
+
+def unmoved_refresh_age_in_h():
+    # Unmoved titles only cost a probe request with fingerprints, so they are looked at much more often
+    return unmoved_probe_interval_in_h if use_fingerprints else max_unmoved_age_in_h
 
-        # Increment the shared counter
-        with counter_lock:
-            total_updated_items += 1
 
+def count_skipped_item():
+    global total_skipped_items
+    with counter_lock:
+        total_skipped_items += 1
+
+
+def skip_item_update(title):
+    # Nothing changed, only the refresh time moves on so the title is not picked again right away
+    sales_writer.submit([("UPDATE sales SET last_update = ?, market_moved = 0 WHERE title = ?", (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), title))], on_commit=count_skipped_item)
+
+
+def defer_item_update(title):
+    # Skipped and failing titles get a fresh last_update too, otherwise they stay the stalest titles forever
+    sales_writer.submit([("UPDATE sales SET last_update = ? WHERE title = ?", (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), title))])
+
+
+def fetch_offer_book(title):
+    """Statements replacing the stored offers (and targets) of the title, empty if the request failed."""
+    if use_order_book:
+        book = order_book_by_title(title)
+        return order_book_ops(title, *book) if book is not None else []
+    return title_offers_ops(title, offer_prices_by_title(title, "100").tolist())
+
+
+async def fetch_offer_book_async(title):
+    if use_order_book:
+        book = await order_book_by_title_async(title)
+        return order_book_ops(title, *book) if book is not None else []
+    return title_offers_ops(title, (await offer_prices_by_title_async(title, "100")).tolist())
+
+
+def get_history(title, latest_date, new_sales):
+    """Stored sales of the title merged with the freshly fetched ones, the sales at latest_date are only counted once."""
+    if latest_date is None:
+        return new_sales
+    stored = history_to_arrays(load_sales_history(get_read_cursor(), title))
+    return merge_sales_arrays(stored, new_sales, latest_date)
+
+
+def get_read_cursor():
+    # One read connection per thread, the writer thread owns the only write connection
+    if not hasattr(read_local, "conn"):
+        read_local.conn = sqlite3.connect(db_path)
+    return read_local.conn.cursor()
+
+
+def compute_item_update(title, history):
+    # history holds (timestamps, prices in cents) arrays, all windows are computed in one vectorized pass
+    stats = compute_sales_stats(*history)
+
+    return (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), stats.avg_min, stats.avg_week, stats.avg_month, stats.avg_all_time, stats.sales_month, str(stats.avg_last_20_sales), stats.volatility, title)
+
+
+def advance_title_state(title, new_sales, fingerprint, refreshed_at):
+    global total_updated_items
+    # Only after the commit, a dropped unit must leave its sales to be fetched again
+    if new_sales[0].size:
+        latest_sale_dates[title] = int(new_sales[0].max())
+    title_fingerprints[title] = (fingerprint, refreshed_at)
+    # Counted here so the totals only include titles the writer actually committed
+    with counter_lock:
+        total_updated_items += 1
+
+
+def write_item_update(row, offer_book_ops, new_sales, fingerprint):
+    # Queued to the writer thread, which commits many titles per transaction
+    sales_writer.submit([('''
+            UPDATE sales SET
+                last_update = ?,
+                avg_min = ?,
+                avg_week = ?,
+                avg_month = ?,
+                avg_all_time = ?,
+                sales_month = ?,
+                avg_last_20_sales = ?,
+                price_volatility = ?,
+                market_moved = 0,
+                refresh_fingerprint = ?,
+                last_full_refresh = ?
+            WHERE title = ?
+        ''', row[:-1] + (fingerprint, row[0], row[-1]))] + offer_book_ops + sales_history_ops(row[-1], zip(new_sales[0].tolist(), new_sales[1].tolist())),
+        on_commit=lambda: advance_title_state(row[-1], new_sales, fingerprint, row[0]))
+    #logger.info(f"Database updated for item: {title}") #bloats the output only for debugging
+
+
+def start_sales_writer():
+    """Starts the writer unless one is running already (e.g. owned by the daemon), returns True if it started one."""
+    global sales_writer
+    if sales_writer is not None:
+        return False
+    sales_writer = DBWriter(db_path, write_batch_rows, write_flush_interval_ms).start()
+    return True
+
+
+def stop_sales_writer():
+    global sales_writer
+    sales_writer.close()
+    logger.info(f"Writer committed {sales_writer.written_units} titles in {sales_writer.flushes} transactions, {sales_writer.failed_units} failed")
+    sales_writer = None
+
+
+def update_item(title_tuple):
+    if stop_event.is_set():
+        return 0  # Exit if stop_event is set
+    title = title_tuple[0]
+
+    if skip_title(title):
+        defer_item_update(title)
+        return 0
+
+    try:
+        # Only fetch the sales that are not stored yet
+        latest_date = latest_sale_dates.get(title)
+        first_page = None
+        if use_fingerprints and use_market_prices and latest_date is not None:
+            first_page = sales_page(title, sales_page_size)
+            fingerprint = title_fingerprint(title, first_page)
+            if fingerprint_unchanged(title, fingerprint):
+                skip_item_update(title)
+                return 0
+        new_sales = fetch_new_sales(title, latest_date, first_page)
+        if first_page is None:
+            fingerprint = title_fingerprint(title, new_sales)
+        history = get_history(title, latest_date, new_sales)
+        offer_book_ops = fetch_offer_book(title)
+
+        write_item_update(compute_item_update(title, history), offer_book_ops, new_sales, fingerprint)
+        #logger.info(f"Updated item: {title}") #bloats the output only for debugging
         return 1
     except Exception as e:
         logger.error(f"Error updating item {title}: {e}")
+        defer_item_update(title)
     return 0  # Return 0 if there was an error to not count the item as processed
 
 
-def update_sales_data():
-    global total_updated_items
+async def update_item_async(title_tuple, semaphore):
+    if stop_event.is_set():
+        return 0
+    title = title_tuple[0]
+
+    if skip_title(title):
+        defer_item_update(title)
+        return 0
+
+    async with semaphore:
+        try:
+            latest_date = latest_sale_dates.get(title)
+            first_page = None
+            if use_fingerprints and use_market_prices and latest_date is not None:
+                first_page = await sales_page_async(title, sales_page_size)
+                fingerprint = title_fingerprint(title, first_page)
+                if fingerprint_unchanged(title, fingerprint):
+                    skip_item_update(title)
+                    return 0
+            new_sales, offer_book_ops = await asyncio.gather(
+                fetch_new_sales_async(title, latest_date, first_page),
+                fetch_offer_book_async(title),
+            )
+            if first_page is None:
+                fingerprint = title_fingerprint(title, new_sales)
+            # The history read and the stats run in a worker thread with its own read connection, the loop keeps fetching
+            row = await asyncio.to_thread(lambda: compute_item_update(title, get_history(title, latest_date, new_sales)))
+            write_item_update(row, offer_book_ops, new_sales, fingerprint)
+            return 1
+        except Exception as e:
+            logger.error(f"Error updating item {title}: {e}")
+            defer_item_update(title)
+    return 0
+
+
+def title_moved(old, new):
+    """old and new are (best_ask, ask_count, best_bid, bid_count), prices in cents."""
+    old_ask, old_ask_count, old_bid, old_bid_count = old
+    new_ask, new_ask_count, new_bid, new_bid_count = new
+    if old_ask is None:
+        return True  # Never priced before
+    for old_price, new_price in ((old_ask, new_ask), (old_bid or 0, new_bid)):
+        if abs(new_price - old_price) > price_move_threshold * max(old_price, 1):
+            return True
+    return new_ask_count < (old_ask_count or 0)  # Offers disappeared, probably sold
+
+
+def refresh_market_prices():
+    """Updates best ask, best bid and their counts of all titles in bulk and flags the titles that moved."""
+    start_time = time.time()
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute("SELECT title, best_ask, ask_count, best_bid, bid_count FROM sales").fetchall()
+    known = {
+        title: tuple(values) for title, *values in rows
+        if title.strip() and not any(bad_word in title.lower() for bad_word in bad_words)
+    }
+
+    prices = aggregated_prices(sorted(known))
+    moved = [(title,) for title, values in prices.items() if title in known and title_moved(known[title], values)]
+    ops = market_prices_ops({title: values for title, values in prices.items() if title in known})
+    with sqlite3.connect(db_path) as conn:
+        enable_wal(conn)
+        if ops:
+            conn.executemany(ops[0][0], [params for sql, params in ops])
+        conn.executemany("UPDATE sales SET market_moved = 1 WHERE title = ?", moved)
+        conn.commit()
+    title_markets.update({title: (values[0], values[1]) for title, values in prices.items() if title in known})
+    logger.info(f"Market prices of {len(prices)} of {len(known)} titles refreshed in {time.time() - start_time:.2f} seconds, {len(moved)} moved")
+    return len(moved)
+
+
+def get_titles_to_refresh():
+    if use_market_prices:
+        refresh_market_prices()
+    load_latest_dates()
     with sqlite3.connect(db_path) as conn: 
-    #with sqlite3.connect('sales_data.db') as conn:
-    #with sqlite3.connect('/home/gira/Bot_and_DB/sales_data.db') as conn:  # Use the full path to your database file on pi
         db_cursor = conn.cursor()
-        
         refresh_time = datetime.now() - timedelta(hours=refresh_time_in_h)
-        db_cursor.execute('SELECT title, last_update, avg_min, avg_week, avg_month, avg_all_time, sales_month, avg_last_20_sales, offers_of_title FROM sales WHERE last_update < ?', (refresh_time.strftime('%Y-%m-%d %H:%M:%S'),))
-        titles = db_cursor.fetchall()
+        if use_market_prices:
+            # Only stale titles whose market moved, the others wait until unmoved_refresh_age_in_h
+            unmoved_time = datetime.now() - timedelta(hours=unmoved_refresh_age_in_h())
+            db_cursor.execute('SELECT title, last_update, avg_min, avg_week, avg_month, avg_all_time, sales_month, avg_last_20_sales, offers_of_title FROM sales WHERE last_update < ? AND (market_moved = 1 OR last_update < ?)', (refresh_time.strftime('%Y-%m-%d %H:%M:%S'), unmoved_time.strftime('%Y-%m-%d %H:%M:%S')))
+        else:
+            db_cursor.execute('SELECT title, last_update, avg_min, avg_week, avg_month, avg_all_time, sales_month, avg_last_20_sales, offers_of_title FROM sales WHERE last_update < ?', (refresh_time.strftime('%Y-%m-%d %H:%M:%S'),))
+        return db_cursor.fetchall()
+
+
+def load_latest_dates():
+    global latest_sale_dates, title_fingerprints, title_markets
+    with sqlite3.connect(db_path) as conn:
+        latest_sale_dates = load_latest_sale_dates(conn.cursor())
+        rows = conn.execute("SELECT title, refresh_fingerprint, last_full_refresh, best_ask, ask_count FROM sales").fetchall()
+    if use_fingerprints and not use_market_prices:
+        logger.info("use_fingerprints needs use_market_prices for the offer count and best ask, all titles are fully refreshed")
+    title_fingerprints = {title: (fingerprint, refreshed_at) for title, fingerprint, refreshed_at, _, _ in rows if fingerprint is not None}
+    title_markets = {title: (best_ask, ask_count) for title, _, _, best_ask, ask_count in rows}
+
+
+async def update_sales_data_async(titles=None):
+    global total_updated_items, total_skipped_items
+    if titles is None:
+        titles = get_titles_to_refresh()
+
+    if not titles:
+        logger.info("All Items up to date!")
+        return
+
+    total_updated_items = 0
+    total_skipped_items = 0
+    start_time = time.time()  # Start the timer
+
+    # The semaphore bounds the titles in flight, the task list itself is created in one go
+    semaphore = asyncio.Semaphore(max_titles_in_flight)
+    owns_writer = start_sales_writer()
+    try:
+        await asyncio.gather(*(update_item_async(title_tuple, semaphore) for title_tuple in titles))
+    finally:
+        await close_async_session()
+        if owns_writer:
+            stop_sales_writer()
+        else:
+            sales_writer.flush()  # The totals are counted on commit
+
+    total_time = time.time() - start_time
+    average_time_per_item = total_time / total_updated_items if total_updated_items > 0 else 0
+
+    logger.info(f"Total updated items: {total_updated_items}")
+    logger.info(f"Skipped unchanged items: {total_skipped_items}")
+    logger.info(f"Total time taken: {total_time:.2f} seconds")
+    logger.info(f"Average time per item: {average_time_per_item:.2f} seconds")
+    logger.info(f"Rate limiter state: {rate_limiter.state()}")
+
+
+def update_sales_data(titles=None):
+    global total_updated_items, total_skipped_items
+    if titles is None:
+        titles = get_titles_to_refresh()
     
     if not titles:
         logger.info("All Items up to date!")
         return
 
     total_updated_items = 0
+    total_skipped_items = 0
     start_time = time.time()  # Start the timer
 
+    owns_writer = start_sales_writer()
     with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
         future_to_title = {executor.submit(update_item, title_tuple): title_tuple for title_tuple in titles}
         for future in concurrent.futures.as_completed(future_to_title):
@@ -156,14 +468,20 @@ def update_sales_data():
 
         # Wait for all threads to complete
         executor.shutdown(wait=True)
+    if owns_writer:
+        stop_sales_writer()
+    else:
+        sales_writer.flush()  # The totals are counted on commit
 
     end_time = time.time()  # End the timer
     total_time = end_time - start_time
     average_time_per_item = total_time / total_updated_items if total_updated_items > 0 else 0
 
     logger.info(f"Total updated items: {total_updated_items}")
+    logger.info(f"Skipped unchanged items: {total_skipped_items}")
     logger.info(f"Total time taken: {total_time:.2f} seconds")
     logger.info(f"Average time per item: {average_time_per_item:.2f} seconds")
+    logger.info(f"Rate limiter state: {rate_limiter.state()}")
 
     
 
@@ -188,14 +506,36 @@ def add_titles_from_file():
                 db_cursor.execute('''
                     INSERT INTO sales (title, last_update, avg_min, avg_week, avg_month, avg_all_time, sales_month, avg_last_20_sales, offers_of_title)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (title, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 0, 0, 0, 0, 0, '0', ''))
+                ''', (title, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 0, 0, 0, 0, 0, '0', None))
                 logger.info(f"Added {title} to the database")
 
         conn.commit()
 
-create_sales_table()  # Ensure the table exists
-add_titles_from_file()  # Add titles from the file
-update_sales_data()  # Update sales data
+
+def refresh_titles(titles):
+    # Titles from the scheduler, in the tuple shape update_item expects
+    title_tuples = [(title,) for title in titles]
+    if use_async_refresh:
+        asyncio.run(update_sales_data_async(title_tuples))
+    else:
+        update_sales_data(title_tuples)
+
+
+def run_continuous_refresh():
+    load_latest_dates()
+    scheduler = RefreshScheduler(db_path, refresh_titles, stop_event, scheduler_batch_size, min_refresh_interval_in_h, bad_words=bad_words,
+                                 max_unmoved_age_in_h=unmoved_refresh_age_in_h() if use_market_prices else None)
+    scheduler.run()
+
+
+def run_refresh():
+    if use_scheduler:
+        run_continuous_refresh()  # Refresh by priority until Ctrl+C
+    elif use_async_refresh:
+        asyncio.run(update_sales_data_async())  # Update sales data
+    else:
+        update_sales_data()  # Update sales data
+
 
 #remove blank titles from DB
 """
@@ -232,3 +572,8 @@ def remove_titles_from_file():
 """
 
 
+if __name__ == "__main__":
+    signal.signal(signal.SIGINT, signal_handler)
+    startup()  # Ensure the tables exist
+    add_titles_from_file()  # Add titles from the file
+    run_refresh()
@@ -1,12 +1,19 @@
 import json
+import queue
+import threading
 import time
 import os
 from datetime import datetime, timedelta
 import sqlite3  # Using SQLite for the database
 
 from credentials import PUBLIC_KEY, SECRET_KEY
-from config import API_URL, url_get_items, timestamp, offer_list_directory, no_data_titles_path, db_path
-from dmarketapi import offers_by_title, filter_outliers, get_offer_from_market, format_offer, balance, buy_item, create_bought_items_table, create_listings_table, create_reduced_fees_table, get_inventory, get_discount_fraction, calculate_prob_profit, get_fee 
+from config import API_URL, url_get_items, timestamp, offer_list_directory, no_data_titles_path, db_path, processed_offers_path
+from offer_dedup import OfferDedup
+from balance_ledger import BalanceLedger
+from market_feed import AdaptivePoller
+from price_index import PriceIndex
+from fee_cache import fee_cache
+from dmarketapi import offers_by_title, filter_outliers, get_offer_from_market, format_offer, balance, buy_item, create_bought_items_table, create_listings_table, create_reduced_fees_table, create_title_offers_table, create_title_targets_table, create_title_hits_table, record_title_hits, enable_wal_mode, get_inventory, get_discount_fraction, calculate_prob_profit, get_fee 
 
 # How much should a skin be discounted? Fee is 10%
 discount_goal = 14
@@ -14,55 +21,85 @@ discount_goal = 14
 min_item_price = 100
 max_item_price = 5000
 
+#Price bands watched by concurrent feeds: (min price, max price, base poll interval in s, gameId as in schemas.Games). Narrow bands keep cheap high churn items from crowding out the valuable ones
+price_bands = [
+    (100, 500, 0.3, "a8db"),
+    (500, 1500, 0.5, "a8db"),
+    (1500, 5000, 1.0, "a8db"),
+]
+
 max_offers_below_buy_price = 2 #2
 
 min_sales_per_month = 20 #20
-offers = get_offer_from_market(min_item_price, max_item_price)
 
 time_to_run_script = 5 #1 = 1H, 0.1 = 10 Min, 0.01 = 1 Min 
 
-#Ensure the table exists
-create_bought_items_table()
-create_listings_table()
-create_reduced_fees_table()
+price_index_refresh_in_s = 300 #how often the in-memory copy of the sales table is reloaded
+hits_flush_interval_in_s = 60 #how often the offers seen per title are written to the DB
+processed_offers_save_interval_in_s = 1800 #how often a background thread writes the processed offers to disk, also saved at shutdown
+max_processed_offers = 200000 #offerIds remembered at most, the oldest are dropped first
+processed_offers_ttl_in_h = 6 #offerIds older than this are forgotten
+balance_reconcile_interval_in_s = 60 #how often the local balance is compared with the api balance
+purchase_workers = 2 #buys running in parallel, the evaluation loop never waits for them
+
+#Sales stats and fees in memory, the sniping loop only reads from here. Loaded in startup()
+price_index = PriceIndex(db_path, fee_cache, price_index_refresh_in_s)
+
+
+def startup():
+    #Ensure the table exists
+    enable_wal_mode()
+    create_bought_items_table()
+    create_listings_table()
+    create_reduced_fees_table()
+    create_title_offers_table()
+    create_title_targets_table()
+    create_title_hits_table()
+
+    #Create / Update the Fee Table, this also loads the fee cache
+    get_fee()
 
-#Create / Update the Fee Table
-get_fee()
+    #Load sales stats into memory once
+    price_index.load()
 
 class MarketOffers:
     def __init__(self):
         self.all_offers = []
-        self.processed_offers = set()  # Set to keep track of processed offers
+        self.processed_offers = OfferDedup(processed_offers_path, max_processed_offers, processed_offers_ttl_in_h)  # Keeps track of processed offers, also across restarts
+        self.processed_offers.load()
+        # One adaptive poller per price band, all share the processed offers and split the rate budget of the feed endpoint
+        self.pollers = [
+            AdaptivePoller(band_min, band_max, self.processed_offers, game_id=game_id, base_interval=interval, rate_share=1 / len(price_bands))
+            for band_min, band_max, interval, game_id in price_bands
+        ]
+        self.offer_queue = queue.Queue()  # New offers of all feeds, consumed by the evaluation loop
+        self.purchase_queue = queue.Queue()  # Offers to buy, their price is already reserved in the ledger
+        self.inventory_queue = queue.Queue()  # Timestamps of bought items waiting for the inventory sync
+        self.pipeline_stop = threading.Event()
+        self.balance_ledger = BalanceLedger(balance, balance_reconcile_interval_in_s)  # Local balance, no api call per buy
         self.stop_thread = False
         self.bad_words = ['key', 'pin', 'sticker', 'case', 'operation', 'pass', 'capsule', 'package', 'challengers', 'patch', 'music', 'kit', 'graffiti', 'contenders']
-        self.conn = sqlite3.connect(db_path)  # Connect to the database
-        self.cursor = self.conn.cursor()
+        self.price_index = price_index  # In-memory sales stats, replaces per offer DB queries
         self.no_data_titles = set()  # Set to keep track of titles with no data
+        self.title_hits = {}  # Offers seen per title since the last flush
+        self.last_hits_flush = time.time()
 
 
     def sort_by_date(self, offers):
         return sorted(offers, key=lambda x: x["createdAt"], reverse=True)
 
-    def get_item_data_from_db(self, title):
-        self.cursor.execute("SELECT avg_min, avg_week, avg_month, avg_all_time, sales_month, avg_last_20_sales, offers_of_title FROM sales WHERE title = ?", (title,))
-        return self.cursor.fetchone()
+    def get_item_data(self, title):
+        return self.price_index.get(title)
 
     def save_no_data_titles(self):
             with open(no_data_titles_path, "w", encoding='utf-8') as file:  # Use the new path
-                file.write(", ".join(self.no_data_titles))
+                file.write(", ".join(list(self.no_data_titles)))  # Copy first, the daemon saves while the evaluation adds
             print(f"missing entrys saved to: {no_data_titles_path}")
 
-    def get_balance_with_retry(self, max_retries=10):
-        retries = 0
-        while retries < max_retries:
-            current_balance = balance()
-            if current_balance is not None:
-                return current_balance
-            retries += 1
-            print(f"Balance request failed. Retrying {retries}/{max_retries}...")
-            time.sleep(1)  # Wait for 1 second before retrying
-        print("Failed to retrieve balance after multiple attempts.")
-        return None    
+    def flush_title_hits(self):
+        record_title_hits(self.title_hits)
+        self.title_hits = {}
+        self.last_hits_flush = time.time()
 
     def insert_bought_item(self, classId, title, timestamp, buy_price, prob_sell_price, prob_profit, status):
         timestamp = timestamp
@@ -74,114 +111,175 @@ class MarketOffers:
             VALUES (?, ?, ?, ?, ?, ?, ?)
             ''', (timed_classId, title, timestamp, buy_price, prob_sell_price, prob_profit, status))
             conn.commit()
-        get_inventory(timestamp)
 
     
 
-    def process_offers_with_pagination(self):
+    def run_feed(self, poller):
+        # Polls one price band and hands the new offers to the evaluation loop
+        while not self.pipeline_stop.is_set():
+            try:
+                for offer in poller.poll():  # Only offers not processed before, already added to the processed offers
+                    self.offer_queue.put(offer)
+            except Exception as e:
+                print(f"Feed {poller.min_price}-{poller.max_price} failed: {e}")
+                self.pipeline_stop.wait(5)
+                continue
+            self.pipeline_stop.wait(poller.interval)
+
+    def run_purchases(self):
+        # Buys the reserved offers, keeps going after a stop until the queue is empty so no reservation is lost
+        while not (self.pipeline_stop.is_set() and self.purchase_queue.empty()):
+            try:
+                purchase = self.purchase_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                self.purchase(*purchase)
+            except Exception as e:
+                print(f"Purchase of {purchase[0]['title']} failed: {e}")
+
+    def purchase(self, offer, avg_last_20_sales, avg_week, discount_rate, prob_profit, prob_sell_price):
+        price = float(offer['price']['USD'])
+        try:
+            buy_response = buy_item(offer['extra']['offerId'], price)
+        except Exception as e:
+            print(f"Buy failed for {offer['title']}: {e}")
+            buy_response = {"orderId": None, "status": "not successfull"}
+        print(f"Buy response: {buy_response}")
+        self.balance_ledger.release(price, spent=buy_response['status'] == 'TxSuccess')
+
+        if buy_response['status'] == 'TxSuccess':
+            # Insert bought item data into the new table, the inventory sync runs in its own thread
+            status = "bought"
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            print(f"insert params classId: {offer['classId']}, Title: {offer['title']}, Timestamp: {timestamp}, offer Price: {price}, Prob sell price: {prob_sell_price}, prob prof: {prob_profit}, status: {status}")
+            self.insert_bought_item(offer['classId'], offer['title'], timestamp, price, prob_sell_price, prob_profit, status)
+            self.inventory_queue.put(timestamp)
+        else:
+            print(f"Transfer not successfull: {buy_response['status']}")
+
+        formatted_offer = format_offer(offer, avg_last_20_sales, avg_week, discount_rate, prob_profit, prob_sell_price, buy_response['status'])
+        self.all_offers.append(formatted_offer)
+
+    def run_inventory_sync(self):
+        # Items still queued at a stop are picked up later by sync_pending_inventory
+        while not self.pipeline_stop.is_set():
+            try:
+                timestamp = self.inventory_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                get_inventory(timestamp)
+            except Exception as e:
+                print(f"Inventory sync failed for {timestamp}: {e}")
+
+    def start_pipeline(self):
+        self.pipeline_stop.clear()
+        self.balance_ledger.reconcile()
+        self.balance_ledger.start()
+        self.processed_offers.start(processed_offers_save_interval_in_s)
+        threads = [
+            threading.Thread(target=self.run_feed, args=(poller,), name=f"feed-{poller.game_id}-{poller.min_price}-{poller.max_price}", daemon=True)
+            for poller in self.pollers
+        ]
+        threads += [threading.Thread(target=self.run_purchases, name=f"purchase-{i}", daemon=True) for i in range(purchase_workers)]
+        threads.append(threading.Thread(target=self.run_inventory_sync, name="inventory-sync", daemon=True))
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def process_offers_with_pagination(self, run_hours=time_to_run_script):
         start_time = time.time()  # Start the timer
-        dup_offer_count = 0
-        offer_count = 0
-        while not self.stop_thread:
-            current_time = time.time()
-            elapsed_time = current_time - start_time
-            if elapsed_time > time_to_run_script * 60 * 60:  # Stop after the specified time
-                break
-
-
-            offers = get_offer_from_market(min_item_price, max_item_price)  # Call the function directly
-
-            for offer in offers:
-                #offer_count += 1
-                offer_key = offer['extra']['offerId']
-                if offer_key in self.processed_offers:
-                    #dup_offer_count += 1
-                    #print(f"duplicate percentage: {(dup_offer_count / offer_count) * 100}%")
-                    continue  # Skip already processed offers
-                self.processed_offers.add(offer_key)  # Add the offer to the set of processed offers
-
-                if any(bad_word in offer['title'].lower() for bad_word in self.bad_words):
-                    continue  # Skip offers with bad words in the title
-
-                # Get item data from the database
-                item_data = self.get_item_data_from_db(offer['title'])
-                if not item_data:
-                    self.no_data_titles.add(offer['title'])  # Add title to the set
-                    #print(f"Title: {offer['title']}, Price: {float(offer['price']['USD'])} Nicht in DB")
-                    continue  # Skip if no data found in the database
-
-                avg_min, avg_week, avg_month, avg_all_time, sales_month, avg_last_20_sales, offers_of_title_str = item_data
-
-                min_avg_price = min(float(avg_last_20_sales), float(avg_week)) 
-
-                fee = float(get_discount_fraction(offer['title']))
-
-                if min_avg_price != 0:
-                    discount_rate = ((min_avg_price - float(offer["price"]["USD"])) / min_avg_price) * 100
-                    discount_rate = round(discount_rate, 2)
-                    if fee < 0.1:
-                        discount_to_add = 10 - (fee * 100)
-                        discount_to_add = round(discount_to_add, 2)
-                        discount_rate = discount_rate + discount_to_add
-                    if discount_rate < discount_goal:
-                        continue  # Skip offers with a discount rate less than the goal
-                
-
-                # Get all offers for a given offer from the database
-                if isinstance(offers_of_title_str, str):
-                    offers_of_title_list = [float(price) for price in offers_of_title_str.split(', ') if price.strip()]
-                    #hier muss ein offers_below_sell_price rein
-                    offers_below_buy_price = [price for price in offers_of_title_list if price < float(offer["price"]["USD"])]
-                else:
-                    offers_below_buy_price = []
-
-                if sales_month >= min_sales_per_month and len(offers_below_buy_price) <= max_offers_below_buy_price and min_avg_price != 0: #offers_below_sell_price hier integrieren
-
-                    prob_sell_price, prob_profit = calculate_prob_profit(offer, discount_rate, min_avg_price, fee)
-
-                    print(f"Title: {offer['title']}, Price: {float(offer['price']['USD'])}")
-                    print(f"Discount rate: {discount_rate:.2f}%")
-                    print(f"Probable sell price: {prob_sell_price}, probable profit in cents with fee: {prob_profit}")
-                    print(f"Average price for last 20 sales: {avg_last_20_sales}")
-                    print(f"Average sales last week: {avg_week}")
-                    print("Amount below offers: " + str(len(offers_below_buy_price)))
-                    
-            
-                    print("Start Buy Check")
-                    
-                     # Check balance before buying
-                    current_balance = self.get_balance_with_retry()
-                    if current_balance is not None and float(current_balance) >= float(offer['price']['USD']):
-                        # Call the buy_item function
-                        buy_response = buy_item(offer['extra']['offerId'], float(offer['price']['USD']))
-                        print(f"Buy response: {buy_response}")
-
-                        if buy_response['status'] == 'TxSuccess':
-                        
-                        
-                        # Insert bought item data into the new table
-                            status = "bought"
-                            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                            print(f"insert params classId: {offer['classId']}, Title: {offer['title']}, Timestamp: {timestamp}, offer Price: {float(offer['price']['USD'])}, Prob sell price: {prob_sell_price}, prob prof: {prob_profit}, status: {status}")
-                            self.insert_bought_item(offer['classId'], offer['title'], timestamp, float(offer['price']['USD']), prob_sell_price, prob_profit, status) 
-                            response = buy_response['status']
-                        else:
-                            print(f"Transfer not successfull: {buy_response['status']}")
-                            response = buy_response['status']
-                        
-                    else:
-                        print("Insufficient balance to buy the item or failed to retrieve balance.")
-                        response = "not successfull"
-                    print("--Offer End--")
-                    
-                    formatted_offer = format_offer(offer, float(avg_last_20_sales), float(avg_week), discount_rate, prob_profit, prob_sell_price,  response)
-                    self.all_offers.append(formatted_offer)
-                    #print(f"dup offer count: {dup_offer_count}")
-                    
-            time.sleep(0.5)
+        threads = self.start_pipeline()
+        try:
+            while not self.stop_thread:
+                current_time = time.time()
+                elapsed_time = current_time - start_time
+                if run_hours is not None and elapsed_time > run_hours * 60 * 60:  # Stop after the specified time, None runs until stopped
+                    break
+
+                try:
+                    offer = self.offer_queue.get(timeout=1)
+                except queue.Empty:
+                    offer = None
+                if offer is not None:
+                    self.evaluate_offer(offer)
+
+                if current_time - self.last_hits_flush > hits_flush_interval_in_s:
+                    self.flush_title_hits()
+        finally:
+            self.pipeline_stop.set()
+            self.balance_ledger.stop()
+            self.processed_offers.stop()
+            for thread in threads:
+                thread.join(timeout=60)
+
+    def evaluate_offer(self, offer):
+        if any(bad_word in offer['title'].lower() for bad_word in self.bad_words):
+            return  # Skip offers with bad words in the title
+
+        # Get item data from the in-memory index
+        item_data = self.get_item_data(offer['title'])
+        if item_data is None:
+            self.no_data_titles.add(offer['title'])  # Add title to the set
+            #print(f"Title: {offer['title']}, Price: {float(offer['price']['USD'])} Nicht in DB")
+            return  # Skip if no data found in the database
+        self.title_hits[offer['title']] = self.title_hits.get(offer['title'], 0) + 1
+
+        avg_week = item_data.avg_week
+        avg_last_20_sales = item_data.avg_last_20_sales
+        sales_month = item_data.sales_month
+
+        min_avg_price = min(avg_last_20_sales, avg_week) 
+
+        fee = self.price_index.fee(offer['title'])
+
+        if min_avg_price != 0:
+            discount_rate = ((min_avg_price - float(offer["price"]["USD"])) / min_avg_price) * 100
+            discount_rate = round(discount_rate, 2)
+            if fee < 0.1:
+                discount_to_add = 10 - (fee * 100)
+                discount_to_add = round(discount_to_add, 2)
+                discount_rate = discount_rate + discount_to_add
+            if discount_rate < discount_goal:
+                return  # Skip offers with a discount rate less than the goal
+
+
+        # Count the competing offers below the buy price with a binary search over the sorted prices
+        #hier muss ein offers_below_sell_price rein
+        offers_below_buy_price = item_data.offers_below(float(offer["price"]["USD"]))
+
+        if sales_month >= min_sales_per_month and offers_below_buy_price <= max_offers_below_buy_price and min_avg_price != 0: #offers_below_sell_price hier integrieren
+
+            prob_sell_price, prob_profit = calculate_prob_profit(offer, discount_rate, min_avg_price, fee)
+
+            print(f"Title: {offer['title']}, Price: {float(offer['price']['USD'])}")
+            print(f"Discount rate: {discount_rate:.2f}%")
+            print(f"Probable sell price: {prob_sell_price}, probable profit in cents with fee: {prob_profit}")
+            print(f"Average price for last 20 sales: {avg_last_20_sales}")
+            print(f"Average sales last week: {avg_week}")
+            print("Amount below offers: " + str(offers_below_buy_price))
+
+
+            print("Start Buy Check")
+
+            # Reserve the price in the local balance, the buy itself runs in a purchase worker
+            if self.balance_ledger.reserve(float(offer['price']['USD'])):
+                self.purchase_queue.put((offer, avg_last_20_sales, avg_week, discount_rate, prob_profit, prob_sell_price))
+            else:
+                print("Insufficient balance to buy the item or failed to retrieve balance.")
+                formatted_offer = format_offer(offer, avg_last_20_sales, avg_week, discount_rate, prob_profit, prob_sell_price, "not successfull")
+                self.all_offers.append(formatted_offer)
+            print("--Offer End--")
 
 
     def save_offers(self):
+        self.flush_title_hits()
+        self.processed_offers.save()
+        print(f"Processed offers: {self.processed_offers.state()}")
+        for poller in self.pollers:
+            print(f"Market feed {poller.game_id} {poller.min_price}-{poller.max_price}: {poller.state()}")
+        print(f"Balance: {self.balance_ledger.state()}")
         if not self.all_offers:
             print("No offers to save.")
             self.save_no_data_titles()  # Save titles with no data
@@ -195,6 +293,9 @@ class MarketOffers:
         self.save_no_data_titles()  # Save titles with no data
 
 if __name__ == "__main__":
+    startup()
+    price_index.start()
+    fee_cache.start(sync_fees=get_fee)
     market_offers = MarketOffers()
     market_offers.process_offers_with_pagination()
     market_offers.save_offers()
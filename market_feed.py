@@ -0,0 +1,101 @@
+import time
+from typing import List
+
+from config import API_URL
+from dmarketapi import get_offer_page_from_market
+from ratelimit import rate_limiter
+
+
+class AdaptivePoller:
+    """Polls the newest market offers of one price range and adapts page size and cadence to the new-offer rate.
+
+    A page full of new offers means offers were missed, so the page grows and older pages are followed via
+    cursor. A page of only duplicates means the feed is polled too often, so the poller backs off.
+    """
+
+    def __init__(self, min_price: int, max_price: int, dedup, game_id: str = "a8db",
+                 min_limit: int = 5, max_limit: int = 100, max_pages: int = 3,
+                 base_interval: float = 0.5, min_interval: float = 0.2, max_interval: float = 5.0, rate_share: float = 1.0):
+        self.min_price = min_price
+        self.max_price = max_price
+        self.dedup = dedup  # Shared OfferDedup, offers returned by poll() are marked as seen
+        self.game_id = game_id
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_pages = max_pages
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.rate_share = rate_share  # Part of the endpoint rate budget this poller may plan with, several feeds split it
+        self.limit = min_limit
+        self.interval = base_interval
+        self.new_rate = 0.0  # Exponential moving average of new offers per second
+        self.polls = 0
+        self.requests = 0
+        self.failed_requests = 0
+        self.new_offers = 0
+        self.duplicate_offers = 0
+        self.last_poll = None
+        self.bucket = rate_limiter.bucket_for(API_URL + "/exchange/v1/market/items")
+
+    def poll(self) -> List[dict]:
+        """Returns the offers not seen before, newest first."""
+        now = time.time()
+        new_offers = []
+        cursor = ""
+        pages = 0
+        all_new = False
+        while pages < self.max_pages:
+            page = get_offer_page_from_market(self.min_price, self.max_price, self.limit, cursor, self.game_id)
+            pages += 1
+            if page is None:
+                self.failed_requests += 1
+                break
+            offers, cursor = page
+            page_new = [offer for offer in offers if not self.dedup.seen(offer["extra"]["offerId"])]
+            new_offers.extend(page_new)
+            self.duplicate_offers += len(offers) - len(page_new)
+            # Follow the cursor only while the whole page was new, the next page may hold missed offers
+            all_new = bool(offers) and len(page_new) == len(offers) and len(offers) >= self.limit
+            if not all_new or not cursor:
+                break
+
+        self.polls += 1
+        self.requests += pages
+        self.new_offers += len(new_offers)
+        self._adapt(now, len(new_offers), all_new, pages)
+        return new_offers
+
+    def _adapt(self, now: float, new_count: int, all_new: bool, pages: int):
+        if self.last_poll is not None:
+            elapsed = max(now - self.last_poll, 1e-3)
+            self.new_rate = 0.8 * self.new_rate + 0.2 * (new_count / elapsed)
+        self.last_poll = now
+
+        if all_new:
+            # Missed offers, bigger pages and faster polling
+            self.limit = min(self.limit * 2, self.max_limit)
+            self.interval = max(self.interval / 2, self.min_interval)
+        elif new_count == 0:
+            # Nothing new, smaller pages and slower polling
+            self.limit = max(self.limit // 2, self.min_limit)
+            self.interval = min(self.interval * 1.5, self.max_interval)
+        else:
+            # Some new offers, drift back to the base cadence
+            self.interval = (self.interval + self.base_interval) / 2
+
+        # Never plan more requests per second than the endpoint family allows
+        self.interval = max(self.interval, pages / max(self.bucket.rate * self.rate_share, 0.1))
+
+    def state(self) -> dict:
+        polled = self.new_offers + self.duplicate_offers
+        return {
+            "limit": self.limit,
+            "interval": round(self.interval, 3),
+            "new_per_s": round(self.new_rate, 3),
+            "polls": self.polls,
+            "requests": self.requests,
+            "failed_requests": self.failed_requests,
+            "new": self.new_offers,
+            "duplicate_share": round(self.duplicate_offers / polled, 4) if polled else 0,
+        }
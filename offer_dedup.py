@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from helpers import PeriodicTask, write_json_atomic
+
+
+class OfferDedup:
+    """Bounded set of seen offerIds. Entries expire after ttl_in_h, the oldest are evicted above max_size,
+    and the set can be saved to disk so a restart keeps knowing the offers it already evaluated."""
+
+    def __init__(self, path: str = None, max_size: int = 200000, ttl_in_h: float = 6):
+        self.path = path
+        self.max_size = max_size
+        self.ttl_in_s = ttl_in_h * 60 * 60
+        self.entries = OrderedDict()  # offerId: first seen, oldest first
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.saves = 0
+        self.lock = threading.Lock()
+        self._saver = None
+
+    def _evict(self, now: float):
+        while self.entries:
+            offer_id, seen_at = next(iter(self.entries.items()))
+            if len(self.entries) <= self.max_size and now - seen_at <= self.ttl_in_s:
+                break
+            self.entries.popitem(last=False)
+            self.evicted += 1
+
+    def seen(self, offer_id: str) -> bool:
+        """Returns True if the offer was seen before, otherwise remembers it and returns False."""
+        with self.lock:
+            if offer_id in self.entries:
+                self.hits += 1
+                return True
+            self.misses += 1
+            now = time.time()
+            self.entries[offer_id] = now
+            self._evict(now)
+            return False
+
+    def __contains__(self, offer_id: str) -> bool:
+        return offer_id in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                entries = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Could not load processed offers from {self.path}: {e}")
+            return
+        with self.lock:
+            for offer_id, seen_at in sorted(entries.items(), key=lambda entry: entry[1]):
+                self.entries[offer_id] = seen_at
+            self._evict(time.time())
+        print(f"Loaded {len(self.entries)} processed offers")
+
+    def save(self):
+        if not self.path:
+            return
+        # Only the eviction and the copy hold the lock, seen() of the feeds waits for nothing else
+        with self.lock:
+            self._evict(time.time())
+            entries = dict(self.entries)
+        write_json_atomic(self.path, entries)
+        self.saves += 1
+
+    def start(self, save_interval: float):
+        """Saves in a background thread every save_interval seconds, so the sniping loop never serializes the set."""
+        if self._saver is None:
+            self._saver = PeriodicTask("processed-offers-save", self.save, save_interval)
+        self._saver.interval = save_interval
+        self._saver.start()
+
+    def stop(self):
+        if self._saver is not None:
+            self._saver.stop()
+
+    def state(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            "evicted": self.evicted,
+            "saves": self.saves,
+        }
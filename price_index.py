@@ -0,0 +1,101 @@
+import sqlite3
+import time
+from bisect import bisect_left
+
+from helpers import PeriodicTask
+
+
+class TitleStats:
+    """Parsed sales row of one title, read by the sniping loop without touching the database."""
+
+    __slots__ = (
+        "avg_min",
+        "avg_week",
+        "avg_month",
+        "avg_all_time",
+        "sales_month",
+        "avg_last_20_sales",
+        "offer_prices",
+        "offer_counts",
+        "best_bid",
+    )
+
+    def __init__(self, avg_min, avg_week, avg_month, avg_all_time, sales_month, avg_last_20_sales, offer_prices, offer_counts=None, best_bid=None):
+        self.avg_min = avg_min
+        self.avg_week = avg_week
+        self.avg_month = avg_month
+        self.avg_all_time = avg_all_time
+        self.sales_month = sales_month
+        self.avg_last_20_sales = avg_last_20_sales
+        self.offer_prices = offer_prices  # Price levels sorted ascending, in cents
+        self.offer_counts = offer_counts if offer_counts is not None else list(range(1, len(offer_prices) + 1))  # Offers up to and including each level
+        self.best_bid = best_bid  # Highest target price in cents, None without targets
+
+    def offers_below(self, price: float) -> int:
+        level = bisect_left(self.offer_prices, price)
+        return self.offer_counts[level - 1] if level else 0
+
+
+class PriceIndex:
+    """In-memory copy of the sales table, reloaded in the background. Fees come from the fee cache."""
+
+    def __init__(self, db_path: str, fee_cache, refresh_interval: float = 300):
+        self.db_path = db_path
+        self.fee_cache = fee_cache
+        self.refresh_interval = refresh_interval
+        self.titles = {}
+        self.loaded_at = 0.0
+        self._refresher = PeriodicTask("price-index-refresh", self.load, refresh_interval)
+
+    def load(self):
+        start_time = time.time()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT title, avg_min, avg_week, avg_month, avg_all_time, sales_month, avg_last_20_sales FROM sales"
+            )
+            rows = cursor.fetchall()
+            cursor.execute("SELECT title, price, amount FROM title_offers ORDER BY title, price")
+            offer_rows = cursor.fetchall()
+            cursor.execute("SELECT title, MAX(price) FROM title_targets GROUP BY title")
+            best_bids = dict(cursor.fetchall())
+
+        # Sorted price levels with the cumulative offer count per title, bisect finds the level below a price
+        offer_prices = {}
+        offer_counts = {}
+        for title, price, amount in offer_rows:
+            prices = offer_prices.setdefault(title, [])
+            counts = offer_counts.setdefault(title, [])
+            prices.append(price)
+            counts.append((counts[-1] if counts else 0) + amount)
+
+        titles = {}
+        for title, avg_min, avg_week, avg_month, avg_all_time, sales_month, avg_last_20_sales in rows:
+            titles[title] = TitleStats(
+                float(avg_min),
+                float(avg_week),
+                float(avg_month),
+                float(avg_all_time),
+                int(sales_month),
+                float(avg_last_20_sales),
+                offer_prices.get(title, []),
+                offer_counts.get(title, []),
+                best_bids.get(title),
+            )
+
+        # Swap the whole dict so readers never see a half loaded index
+        self.titles = titles
+        self.loaded_at = time.time()
+        print(f"Price index loaded {len(titles)} titles in {self.loaded_at - start_time:.2f} seconds")
+
+    def get(self, title: str) -> TitleStats:
+        return self.titles.get(title)
+
+    def fee(self, title: str) -> float:
+        return self.fee_cache.get(title)
+
+    def start(self):
+        self._refresher.start()
+
+    def stop(self):
+        self._refresher.stop()
@@ -0,0 +1,154 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+from config import rate_limit_families, rate_limit_priority_reserve
+
+
+# Priorities, lower value wins. Buys and the sniping feed pre-empt background refresh traffic.
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+
+
+class TokenBucket:
+    """Token bucket for one endpoint family, tuned at runtime by the RateLimit-* headers."""
+
+    def __init__(self, name: str, rate: float, capacity: float):
+        self.name = name
+        self.rate = float(rate)  # Tokens added per second
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.window = 1.0  # Longest RateLimit-Reset seen, used as window length
+        self.blocked_until = 0.0
+        self.last_refill = time.monotonic()
+        self.high_waiting = 0
+        self.granted = {PRIORITY_HIGH: 0, PRIORITY_LOW: 0}
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def _reserve(self, priority: int) -> float:
+        """Take a token if allowed, returns 0 on success or the seconds to wait otherwise."""
+        now = time.monotonic()
+        with self.lock:
+            self._refill(now)
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            # Low priority traffic leaves a reserve for high priority calls and yields to waiting ones
+            needed = 1.0
+            if priority != PRIORITY_HIGH:
+                if self.high_waiting:
+                    return 1.0 / self.rate
+                needed += self.capacity * rate_limit_priority_reserve
+            if self.tokens >= needed:
+                self.tokens -= 1.0
+                self.granted[priority] = self.granted.get(priority, 0) + 1
+                return 0.0
+            return (needed - self.tokens) / self.rate
+
+    def acquire(self, priority: int = PRIORITY_LOW):
+        if priority == PRIORITY_HIGH:
+            with self.lock:
+                self.high_waiting += 1
+        try:
+            while True:
+                wait = self._reserve(priority)
+                if wait <= 0:
+                    return
+                time.sleep(min(wait, 1.0))
+        finally:
+            if priority == PRIORITY_HIGH:
+                with self.lock:
+                    self.high_waiting -= 1
+
+    def update_from_headers(self, remaining: int, reset: int, limit: int):
+        now = time.monotonic()
+        with self.lock:
+            self._refill(now)
+            if limit and limit > 0:
+                self.window = max(self.window, float(reset or 1))
+                self.capacity = float(limit)
+                self.rate = max(limit / self.window, 0.1)
+            if remaining is not None:
+                self.tokens = min(self.tokens, float(remaining))
+                if remaining <= 0:
+                    self.blocked_until = max(self.blocked_until, now + max(reset or 1, 1))
+
+    def penalize(self, wait: float):
+        """Called on 429/403, the whole family pauses instead of only the failing thread."""
+        now = time.monotonic()
+        with self.lock:
+            self.throttled += 1
+            self.tokens = 0.0
+            self.last_refill = now
+            self.blocked_until = max(self.blocked_until, now + wait)
+
+    def state(self) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            self._refill(now)
+            return {
+                "rate": round(self.rate, 3),
+                "capacity": self.capacity,
+                "tokens": round(self.tokens, 2),
+                "blocked_for": round(max(self.blocked_until - now, 0.0), 2),
+                "high_waiting": self.high_waiting,
+                "granted_high": self.granted[PRIORITY_HIGH],
+                "granted_low": self.granted[PRIORITY_LOW],
+                "throttled": self.throttled,
+            }
+
+
+class RateLimitGovernor:
+    """Shares one bucket per endpoint family between all threads of the process."""
+
+    def __init__(self, families: dict):
+        # Longest prefix first so specific endpoints win over their api group
+        self.prefixes = sorted((prefix for prefix in families if prefix != "default"), key=len, reverse=True)
+        self.buckets = {
+            prefix: TokenBucket(prefix, rate, burst) for prefix, (rate, burst) in families.items()
+        }
+
+    def bucket_for(self, url: str) -> TokenBucket:
+        url_path = urlsplit(url).path
+        for prefix in self.prefixes:
+            if url_path.startswith(prefix):
+                return self.buckets[prefix]
+        return self.buckets["default"]
+
+    def acquire(self, url: str, priority: int = PRIORITY_LOW):
+        self.bucket_for(url).acquire(priority)
+
+    def reserve(self, url: str, priority: int = PRIORITY_LOW) -> float:
+        """Non blocking variant for asyncio callers, returns the seconds to wait before retrying."""
+        return self.bucket_for(url)._reserve(priority)
+
+    def update_from_headers(self, url: str, headers):
+        try:
+            remaining = headers.get("RateLimit-Remaining")
+            reset = headers.get("RateLimit-Reset")
+            limit = headers.get("RateLimit-Limit")
+            self.bucket_for(url).update_from_headers(
+                int(remaining) if remaining is not None else None,
+                int(reset) if reset is not None else 1,
+                int(limit) if limit is not None else None,
+            )
+        except ValueError:
+            pass  # Malformed headers, keep the configured budget
+
+    def penalize(self, url: str, headers=None, default_wait: float = 5):
+        wait = default_wait
+        if headers is not None:
+            value = headers.get("Retry-After") or headers.get("RateLimit-Reset")
+            if value is not None and str(value).isdigit():
+                wait = max(int(value), 1)
+        self.bucket_for(url).penalize(wait)
+
+    def state(self) -> dict:
+        return {prefix: bucket.state() for prefix, bucket in self.buckets.items()}
+
+
+rate_limiter = RateLimitGovernor(rate_limit_families)
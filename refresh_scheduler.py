@@ -0,0 +1,92 @@
+import heapq
+import logging
+import math
+import sqlite3
+import time
+from datetime import datetime
+
+
+logger = logging.getLogger(__name__)
+
+
+# Weights of the refresh priority, staleness is multiplied by 1 + the weighted signals
+velocity_weight = 1.0  # per log(1 + sales per month)
+volatility_weight = 5.0  # per coefficient of variation of the monthly prices
+hits_weight = 2.0  # per log(1 + recent offers seen by the sniper)
+hits_half_life_in_h = 24  # sniper hits lose half their weight after this time
+moved_weight = 3.0  # titles whose best ask or bid moved in the bulk market price refresh
+
+
+def refresh_priority(staleness_in_h: float, sales_month: int, volatility: float, hits: float, moved: bool = False) -> float:
+    """Stale titles rise over time, titles that trade a lot, move a lot or show up in the sniper rise faster."""
+    return staleness_in_h * (
+        1
+        + velocity_weight * math.log1p(max(sales_month, 0))
+        + volatility_weight * max(volatility, 0)
+        + hits_weight * math.log1p(max(hits, 0))
+        + (moved_weight if moved else 0)
+    )
+
+
+def decayed_hits(hits: int, last_hit: str, now: float) -> float:
+    if not hits or not last_hit:
+        return 0
+    age_in_h = (now - datetime.strptime(last_hit, "%Y-%m-%d %H:%M:%S").timestamp()) / 3600
+    return hits * 0.5 ** (max(age_in_h, 0) / hits_half_life_in_h)
+
+
+class RefreshScheduler:
+    """Continuously refreshes the sales table in priority order instead of one cron batch of all stale titles."""
+
+    def __init__(self, db_path: str, refresh_titles, stop_event, batch_size: int = 200,
+                 min_refresh_interval_in_h: float = 0.1, idle_sleep_in_s: float = 30, bad_words: list = (),
+                 max_unmoved_age_in_h: float = None):
+        self.db_path = db_path
+        self.refresh_titles = refresh_titles  # Called with a list of titles, highest priority first
+        self.stop_event = stop_event
+        self.batch_size = batch_size
+        self.min_refresh_interval_in_h = min_refresh_interval_in_h
+        self.idle_sleep_in_s = idle_sleep_in_s
+        self.bad_words = list(bad_words)  # Titles the refresh skips anyway, they would never leave the top of the batch
+        self.max_unmoved_age_in_h = max_unmoved_age_in_h  # Titles whose market did not move wait this long, None refreshes all
+        self.batches = 0
+        self.refreshed = 0
+
+    def load_candidates(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT s.title, s.last_update, s.sales_month, s.price_volatility, s.market_moved, h.hits, h.last_hit
+                FROM sales s LEFT JOIN title_hits h ON h.title = s.title
+                """
+            )
+            return [
+                row for row in cursor.fetchall()
+                if row[0].strip() and not any(bad_word in row[0].lower() for bad_word in self.bad_words)
+            ]
+
+    def next_batch(self) -> list:
+        now = time.time()
+        prioritized = []
+        for title, last_update, sales_month, volatility, moved, hits, last_hit in self.load_candidates():
+            staleness_in_h = (now - datetime.strptime(last_update, "%Y-%m-%d %H:%M:%S").timestamp()) / 3600
+            if staleness_in_h < self.min_refresh_interval_in_h:
+                continue  # Just refreshed, nothing to gain yet
+            if self.max_unmoved_age_in_h is not None and not moved and staleness_in_h < self.max_unmoved_age_in_h:
+                continue  # Market did not move, the same filter as get_titles_to_refresh
+            priority = refresh_priority(staleness_in_h, sales_month or 0, volatility or 0, decayed_hits(hits, last_hit, now), bool(moved))
+            prioritized.append((priority, title))
+        return [title for priority, title in heapq.nlargest(self.batch_size, prioritized)]
+
+    def run(self):
+        while not self.stop_event.is_set():
+            batch = self.next_batch()
+            if not batch:
+                self.stop_event.wait(self.idle_sleep_in_s)
+                continue
+            start_time = time.time()
+            self.refresh_titles(batch)
+            self.batches += 1
+            self.refreshed += len(batch)
+            logger.info(f"Refreshed batch {self.batches} with {len(batch)} titles in {time.time() - start_time:.2f} seconds, {self.refreshed} in total")
@@ -0,0 +1,96 @@
+import time
+from typing import Dict, NamedTuple, Tuple
+
+import numpy as np
+
+
+WEEK_IN_S = 7 * 24 * 60 * 60
+MONTH_IN_S = 4 * WEEK_IN_S
+IQR_FACTOR = 0.3  # Same bounds as dmarketapi.filter_outliers
+
+
+class SalesStats(NamedTuple):
+    avg_min: float
+    avg_week: float
+    avg_month: float
+    avg_all_time: float
+    sales_month: int
+    avg_last_20_sales: float
+    volatility: float  # Coefficient of variation of the outlier filtered monthly prices
+
+
+def history_to_arrays(history) -> Tuple[np.ndarray, np.ndarray]:
+    """(timestamp, price) or (timestamp, price, amount) tuples to an int64 timestamp and a float64 price array,
+    a row with an amount is repeated that often."""
+    if not history:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    data = np.asarray(history, dtype=np.float64)
+    if data.shape[1] > 2:
+        data = np.repeat(data, data[:, 2].astype(np.int64), axis=0)
+    return data[:, 0].astype(np.int64), data[:, 1]
+
+
+def merge_sales_arrays(stored: tuple, fetched: tuple, boundary: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenates stored and fetched (timestamps, prices) pairs. The fetch holds every sale from boundary on,
+    so only stored sales at or after boundary are replaced. Distinct sales with the same second and price are kept."""
+    if boundary is not None and fetched[0].size:
+        keep = stored[0] < boundary
+        stored = (stored[0][keep], stored[1][keep])
+    return np.concatenate((stored[0], fetched[0])), np.concatenate((stored[1], fetched[1]))
+
+
+def iqr_mask(prices: np.ndarray) -> np.ndarray:
+    q1, q3 = np.percentile(prices, [25, 75])
+    iqr = q3 - q1
+    return (prices >= q1 - IQR_FACTOR * iqr) & (prices <= q3 + IQR_FACTOR * iqr)
+
+
+def filtered_mean(prices: np.ndarray) -> float:
+    if prices.size == 0:
+        return 0
+    return round(float(prices[iqr_mask(prices)].mean()), 2)
+
+
+def compute_sales_stats(timestamps: np.ndarray, prices: np.ndarray, now: float = None, last_n: int = 20) -> SalesStats:
+    """Aggregates of one title, prices in cents. Outliers are removed per window like in filter_outliers."""
+    if prices.size == 0:
+        return SalesStats(0, 0, 0, 0, 0, 0, 0)
+    now = time.time() if now is None else now
+
+    week_mask = timestamps >= now - WEEK_IN_S
+    month_mask = timestamps >= now - MONTH_IN_S
+
+    avg_week = filtered_mean(prices[week_mask])
+    month_prices = prices[month_mask]
+    avg_month = filtered_mean(month_prices)
+    volatility = 0.0
+    if month_prices.size > 1:
+        month_prices = month_prices[iqr_mask(month_prices)]
+        mean = month_prices.mean()
+        volatility = round(float(month_prices.std() / mean), 4) if mean > 0 else 0.0
+
+    all_time_mask = iqr_mask(prices)
+    all_time_prices = prices[all_time_mask]
+    avg_all_time = round(float(all_time_prices.mean()), 2) if all_time_prices.size else 0
+
+    # Most recent sales among the outlier filtered ones, argpartition avoids a full sort
+    all_time_timestamps = timestamps[all_time_mask]
+    if all_time_prices.size > last_n:
+        recent = np.argpartition(all_time_timestamps, all_time_timestamps.size - last_n)[-last_n:]
+        avg_last_n = round(float(all_time_prices[recent].mean()), 2)
+    else:
+        avg_last_n = avg_all_time
+
+    avg_values = [avg for avg in (avg_week, avg_month) if avg > 0]
+    avg_min = round(min(avg_values), 2) if avg_values else 0
+
+    return SalesStats(avg_min, avg_week, avg_month, avg_all_time, int(month_mask.sum()), avg_last_n, volatility)
+
+
+def compute_sales_stats_batch(histories: Dict[str, tuple], now: float = None, last_n: int = 20) -> Dict[str, SalesStats]:
+    """Stats for many titles, histories maps title to its (timestamps, prices) arrays."""
+    now = time.time() if now is None else now
+    return {
+        title: compute_sales_stats(timestamps, prices, now, last_n)
+        for title, (timestamps, prices) in histories.items()
+    }
@@ -0,0 +1,69 @@
+import json
+import threading
+import time
+from urllib.parse import urlencode
+
+
+SIGNATURE_PREFIX = "dmar ed25519 "
+
+
+def encode_body(body: dict) -> bytes:
+    """The exact bytes that are signed and sent, api_call posts these instead of serializing the body again."""
+    return json.dumps(body).encode("utf-8")
+
+
+def canonical_path(api_path: str, params: dict = None) -> str:
+    """Path with the query string as requests sends it, None values are left out like requests does."""
+    if not params:
+        return api_path
+    query = urlencode({key: value for key, value in params.items() if value is not None}, doseq=True)
+    return f"{api_path}?{query}" if query else api_path
+
+
+class RequestSigner:
+    """Ed25519 request signing. The key is decoded once, GET signatures are reused within the same nonce second."""
+
+    def __init__(self, public_key: str, secret_key: str):
+        self.public_key = public_key
+        self._secret_key = bytes.fromhex(secret_key)
+        self._crypto_sign = None  # nacl is imported on the first signature
+        self._nonce = None
+        self._cache = {}  # (method, canonical path) of the current nonce second: headers
+        self._lock = threading.Lock()
+        self.signed = 0
+        self.reused = 0
+
+    def _sign(self, message: str, nonce: str) -> dict:
+        if self._crypto_sign is None:
+            from nacl.bindings import crypto_sign
+            self._crypto_sign = crypto_sign
+        signature = self._crypto_sign(message.encode("utf-8"), self._secret_key)[:64].hex()
+        self.signed += 1
+        return {
+            "X-Api-Key": self.public_key,
+            "X-Request-Sign": SIGNATURE_PREFIX + signature,
+            "X-Sign-Date": nonce,
+        }
+
+    def sign(self, method: str, api_path: str, params: dict = None, body=None) -> dict:
+        """body is a dict or the bytes from encode_body."""
+        nonce = str(round(time.time()))
+        path = canonical_path(api_path, params)
+        if body:
+            body_bytes = body if isinstance(body, bytes) else encode_body(body)
+            return self._sign(method + path + body_bytes.decode("utf-8") + nonce, nonce)
+
+        key = (method, path)
+        with self._lock:
+            if nonce != self._nonce:
+                self._nonce = nonce
+                self._cache = {}
+            headers = self._cache.get(key)
+        if headers is not None:
+            self.reused += 1
+            return dict(headers)
+        headers = self._sign(method + path + nonce, nonce)
+        with self._lock:
+            if nonce == self._nonce:
+                self._cache[key] = headers
+        return dict(headers)
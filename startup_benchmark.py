@@ -0,0 +1,54 @@
+import subprocess
+import sys
+
+
+# Import time budget in seconds per entry script, measured as the best of several fresh interpreters.
+# On the Pi pass a factor, e.g. "python startup_benchmark.py 8"
+import_budgets = {
+    "daily": 0.2,
+    "inv_sell_loop": 0.2,
+    "main": 0.3,
+    "iterate_DB": 0.6,
+    "daemon": 0.6,
+}
+runs = 5
+heavy_modules = ["numpy", "pydantic", "schemas", "aiohttp", "nacl", "requests"]
+
+MEASURE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(",".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+
+def measure(module: str) -> tuple:
+    best = None
+    loaded = ""
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", MEASURE.format(module=module, heavy=heavy_modules)],
+            capture_output=True, text=True, check=True,
+        )
+        seconds, loaded = result.stdout.splitlines()[-2:]  # Anything the module prints comes before these
+        best = float(seconds) if best is None else min(best, float(seconds))
+    return best, loaded
+
+
+def main():
+    factor = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    over_budget = []
+    for module, budget in import_budgets.items():
+        seconds, loaded = measure(module)
+        status = "ok" if seconds <= budget * factor else "OVER BUDGET"
+        print(f"{module:<15} {seconds * 1000:7.1f} ms  budget {budget * factor * 1000:7.1f} ms  {status}  loads: {loaded or '-'}")
+        if status != "ok":
+            over_budget.append(module)
+    if over_budget:
+        print(f"Import time over budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()